@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""离线性能基准和压测工具，依赖进程内的码云替身，不访问网络"""
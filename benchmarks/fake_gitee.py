@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+进程内的码云v5 API替身
+在本机端口上模拟contents/blobs/commits接口，可以设置延迟、错误率和请求文件数量，
+用于离线压测和回放，不需要网络和真实token
+"""
+
+import sys
+import json
+import time
+import signal
+import argparse
+import socket
+import random
+import base64
+import hashlib
+import threading
+import urllib.parse
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from gitee_client import git_blob_sha
+
+
+class FakeGitee:
+    """内存中的仓库加上一个HTTP服务，接口路径与码云v5一致（/api/v5/repos/{owner}/{repo}/...）"""
+
+    def __init__(self, repo="chav-pikey/license-serve", latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.repo = repo
+        # 每个请求的固定延迟和随机抖动（秒）
+        self.latency = latency
+        self.jitter = jitter
+        # 返回502的概率
+        self.error_rate = error_rate
+        self.files = {}
+        # 出现过的所有blob，与git一样删除文件后仍可按sha读取
+        self.blobs = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = None
+        self._thread = None
+
+    @property
+    def api_base(self):
+        return f"http://127.0.0.1:{self._server.server_port}/api/v5"
+
+    def start(self, port=0):
+        """启动服务（port为0时使用随机端口），返回api_base"""
+        fake = self
+
+        class Handler(FakeGiteeHandler):
+            server_fake = fake
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-gitee", daemon=True)
+        self._thread.start()
+        return self.api_base
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def put_file(self, path, text):
+        with self._lock:
+            self.files[path] = text
+            self.blobs[git_blob_sha(text)] = text
+
+    def reset(self):
+        """清空仓库和调用计数"""
+        with self._lock:
+            self.files.clear()
+            self.blobs.clear()
+            self.calls.clear()
+
+    def seed_requests(self, count, pending_ratio=1.0, now=None):
+        """生成count个请求文件，其中pending_ratio比例为24小时内的pending请求，其余为已批准，返回机器码列表"""
+        now = now or datetime.now()
+        pending_count = int(round(count * pending_ratio))
+        machine_codes = []
+        for i in range(count):
+            machine_code = f"BENCH{i:06d}"
+            pending = i < pending_count
+            request_time = now - timedelta(minutes=(i % 600) + 1)
+            self.put_file(f"requests/{machine_code}.json", json.dumps({
+                "machine_code": machine_code,
+                "status": "pending" if pending else "approved",
+                "request_time": request_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "client_version": "bench"
+            }, ensure_ascii=False, indent=2))
+            machine_codes.append(machine_code)
+        return machine_codes
+
+    def take_calls(self):
+        """返回并清空调用计数"""
+        with self._lock:
+            calls = dict(self.calls)
+            self.calls.clear()
+        return calls
+
+    def count(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._random.random() * self.jitter)
+
+    def should_fail(self):
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def listing(self, path, host):
+        """目录下的文件和子目录，目录不存在时返回None"""
+        prefix = path.strip('/') + '/'
+        with self._lock:
+            children = [p for p in self.files if p.startswith(prefix)]
+            entries = {}
+            for child in children:
+                name = child[len(prefix):].split('/', 1)[0]
+                if '/' in child[len(prefix):]:
+                    entries.setdefault(name, {"name": name, "path": prefix + name, "type": "dir",
+                                              "sha": None, "download_url": None})
+                else:
+                    entries[name] = self._entry(child, host, with_content=False)
+        if not entries:
+            return None
+        return [entries[name] for name in sorted(entries)]
+
+    def entry(self, path, host):
+        with self._lock:
+            if path not in self.files:
+                return None
+            return self._entry(path, host, with_content=True)
+
+    def _entry(self, path, host, with_content):
+        text = self.files[path]
+        entry = {
+            "name": path.rsplit('/', 1)[-1],
+            "path": path,
+            "type": "file",
+            "sha": git_blob_sha(text),
+            "size": len(text.encode('utf-8')),
+            "download_url": f"http://{host}/{self.repo}/raw/master/{path}"
+        }
+        if with_content:
+            entry["encoding"] = "base64"
+            entry["content"] = base64.b64encode(text.encode('utf-8')).decode('utf-8')
+        return entry
+
+    def commit(self, actions):
+        """按commits API的actions修改仓库，任一动作无效时整体不生效，返回错误信息或None"""
+        with self._lock:
+            for action in actions:
+                exists = action.get('path') in self.files
+                if action.get('action') == 'create' and exists:
+                    return f"文件已存在: {action['path']}"
+                if action.get('action') in ('update', 'delete') and not exists:
+                    return f"文件不存在: {action['path']}"
+            for action in actions:
+                if action['action'] == 'delete':
+                    self.files.pop(action['path'], None)
+                else:
+                    text = base64.b64decode(action['content']).decode('utf-8')
+                    self.files[action['path']] = text
+                    self.blobs[git_blob_sha(text)] = text
+        return None
+
+
+class FakeGiteeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_fake = None
+
+    def setup(self):
+        super().setup()
+        # 响应头和响应体分两次写入，关闭Nagle避免与客户端的延迟确认叠加出40ms的停顿
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def _handle(self, method):
+        fake = self.server_fake
+        parsed = urllib.parse.urlparse(self.path)
+        body = self._read_body()
+        fake.delay()
+
+        route, path = self._route(parsed.path)
+        fake.count(f"{method} {route}")
+        if fake.should_fail():
+            fake.count("injected_error")
+            return self._send_json(502, {"message": "Bad Gateway"})
+
+        if route == 'raw' and method == 'GET':
+            with fake._lock:
+                text = fake.files.get(path)
+            if text is None:
+                return self._send_json(404, {"message": "Not Found"})
+            return self._send(200, text.encode('utf-8'), 'text/plain; charset=utf-8')
+        if route == 'blobs' and method == 'GET':
+            with fake._lock:
+                text = fake.blobs.get(path)
+            if text is None:
+                return self._send_json(404, {"message": "Not Found"})
+            return self._send_json(200, {"sha": path, "size": len(text.encode('utf-8')), "encoding": "base64",
+                                         "content": base64.b64encode(text.encode('utf-8')).decode('utf-8')})
+        if route == 'commits' and method == 'POST':
+            error = fake.commit(body.get('actions') or [])
+            if error:
+                return self._send_json(400, {"message": error})
+            return self._send_json(201, {"sha": hashlib.sha1(json.dumps(body).encode()).hexdigest()})
+        if route == 'contents':
+            return self._handle_contents(method, path, body)
+        return self._send_json(404, {"message": "Not Found"})
+
+    def _handle_contents(self, method, path, body):
+        fake = self.server_fake
+        host = self.headers.get('Host', '127.0.0.1')
+        if method == 'GET':
+            entry = fake.entry(path, host)
+            if entry is None:
+                entry = fake.listing(path, host)
+            if entry is None:
+                return self._send_json(404, {"message": "Not Found"})
+            return self._send_json(200, entry, conditional=True)
+
+        text = base64.b64decode(body.get('content', '')).decode('utf-8')
+        with fake._lock:
+            current = fake.files.get(path)
+            if method == 'POST' and current is not None:
+                return self._send_json(400, {"message": "文件名已存在"})
+            if method == 'PUT':
+                if current is None:
+                    return self._send_json(404, {"message": "Not Found"})
+                if body.get('sha') != git_blob_sha(current):
+                    return self._send_json(409, {"message": "sha不匹配"})
+            fake.files[path] = text
+            fake.blobs[git_blob_sha(text)] = text
+        return self._send_json(201 if method == 'POST' else 200,
+                               {"content": fake.entry(path, host), "commit": {}})
+
+    def _route(self, url_path):
+        """返回 (接口类型, 仓库内路径或sha)"""
+        fake = self.server_fake
+        raw_prefix = f"/{fake.repo}/raw/master/"
+        if url_path.startswith(raw_prefix):
+            return 'raw', urllib.parse.unquote(url_path[len(raw_prefix):])
+        repo_prefix = f"/api/v5/repos/{fake.repo}/"
+        if not url_path.startswith(repo_prefix):
+            return 'unknown', url_path
+        rest = urllib.parse.unquote(url_path[len(repo_prefix):])
+        if rest.startswith('contents/'):
+            return 'contents', rest[len('contents/'):]
+        if rest.startswith('git/blobs/'):
+            return 'blobs', rest[len('git/blobs/'):]
+        if rest == 'commits':
+            return 'commits', ''
+        return 'unknown', rest
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _send_json(self, status, payload, conditional=False):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        if conditional:
+            etag = 'W/"' + hashlib.md5(data).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.server_fake.count("not_modified")
+                return self._send(304, b'', None, {"ETag": etag})
+            return self._send(status, data, 'application/json; charset=utf-8', {"ETag": etag})
+        return self._send(status, data, 'application/json; charset=utf-8')
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+
+def main(argv=None):
+    """作为独立进程运行（压测时与被测服务、压测客户端分开，避免争用同一个GIL），
+    启动后在标准输出打印一行JSON：{"api_base": ..., "pending": ...}"""
+    parser = argparse.ArgumentParser(description="码云v5 API替身")
+    parser.add_argument('--port', type=int, default=0, help="监听端口，0为随机端口")
+    parser.add_argument('--files', type=int, default=100, help="请求文件数量")
+    parser.add_argument('--pending-ratio', type=float, default=0.5, help="pending请求占请求文件的比例")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="每个请求的固定延迟（毫秒）")
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help="随机附加延迟上限（毫秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回502的概率")
+    parser.add_argument('--seed', type=int, default=1, help="延迟和错误注入的随机种子")
+    args = parser.parse_args(argv)
+
+    fake = FakeGitee(latency=args.latency_ms / 1000.0, jitter=args.jitter_ms / 1000.0,
+                     error_rate=args.error_rate, seed=args.seed)
+    fake.seed_requests(args.files, pending_ratio=args.pending_ratio)
+    api_base = fake.start(args.port)
+    print(json.dumps({"api_base": api_base, "pending": int(round(args.files * args.pending_ratio))}), flush=True)
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
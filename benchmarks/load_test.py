@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn下的并发压测
+与线上（Procfile / railway.json）一样用gunicorn启动服务，上游指向独立进程中的码云替身，
+由大量虚拟客户端混合调用 /api/requests、/api/sync、/api/approve、/api/reject，
+逐级增加客户端数量，报告每一级的吞吐量、延迟、排队时间和错误率，并找出饱和点
+
+    python benchmarks/load_test.py --worker-classes sync,gthread --workers 1,4 --clients 1,4,16,64
+    python benchmarks/load_test.py --worker-classes gthread --threads 8 --mix requests=90,sync=2,approve=4,reject=4
+
+排队时间 = 客户端测得的耗时 - 服务端在Server-Timing响应头中报告的处理耗时，
+包括在gunicorn监听队列、worker线程池中等待的时间和本机网络开销。
+虚拟客户端是压测进程中的线程，客户端很多时压测进程本身也可能成为瓶颈，最好在空闲的多核机器上运行
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import importlib.util
+import subprocess
+from collections import Counter, defaultdict
+from datetime import datetime
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.run_benchmarks import RESULTS_DIR, percentile, git_revision
+
+# 各worker类型需要的额外依赖
+WORKER_DEPENDENCIES = {'gevent': 'gevent', 'eventlet': 'eventlet', 'tornado': 'tornado'}
+OPERATIONS = ('requests', 'sync', 'approve', 'reject')
+SERVER_TIMING_RE = re.compile(r'\bapp;dur=([0-9.]+)')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def parse_list(value, convert=str):
+    return [convert(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def parse_mix(value):
+    """解析 requests=80,sync=5,approve=10,reject=5 形式的流量比例"""
+    mix = {}
+    for item in parse_list(value):
+        name, _, weight = item.partition('=')
+        if name not in OPERATIONS:
+            raise SystemExit(f"未知的操作: {name}（可选 {', '.join(OPERATIONS)}）")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise SystemExit("流量比例不能为空")
+    return mix
+
+
+class FakeGiteeProcess:
+    """在独立进程中运行码云替身，避免与压测客户端争用同一个GIL"""
+
+    def __init__(self, args):
+        self.args = args
+        self.process = None
+        self.api_base = None
+        self.pending = 0
+
+    def start(self):
+        command = [sys.executable, '-m', 'benchmarks.fake_gitee',
+                   '--files', str(self.args.files), '--pending-ratio', str(self.args.pending_ratio),
+                   '--latency-ms', str(self.args.latency_ms), '--jitter-ms', str(self.args.jitter_ms),
+                   '--error-rate', str(self.args.error_rate), '--seed', str(self.args.seed)]
+        self.process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+        line = self.process.stdout.readline()
+        if not line:
+            self.stop()
+            raise RuntimeError("码云替身启动失败")
+        info = json.loads(line)
+        self.api_base = info['api_base']
+        self.pending = info['pending']
+        return self.api_base
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+class GunicornServer:
+    """用gunicorn启动被测服务，worker_class为sync/gthread/gevent等"""
+
+    def __init__(self, worker_class, workers, args, api_base, workdir):
+        self.worker_class = worker_class
+        self.workers = workers
+        self.args = args
+        self.api_base = api_base
+        self.workdir = workdir
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.log_path = os.path.join(workdir, f"gunicorn-{worker_class}-{workers}.log")
+        self.process = None
+
+    def command(self):
+        command = [sys.executable, '-m', 'gunicorn', 'mobile_auth_server_clean:app',
+                   '--bind', f"127.0.0.1:{self.port}",
+                   '--worker-class', self.worker_class,
+                   '--workers', str(self.workers),
+                   '--timeout', str(self.args.worker_timeout),
+                   '--backlog', str(self.args.backlog)]
+        if self.worker_class == 'gthread':
+            command += ['--threads', str(self.args.threads)]
+        if self.worker_class in ('gevent', 'eventlet'):
+            command += ['--worker-connections', str(self.args.worker_connections)]
+        if self.args.verbose:
+            command += ['--access-logfile', '-']
+        return command
+
+    def environment(self):
+        env = dict(os.environ)
+        env.update({
+            'STORAGE_BACKEND': 'gitee',
+            'GITEE_API_BASE': self.api_base,
+            'JOB_DB_PATH': os.path.join(self.workdir, 'write_jobs.sqlite3'),
+            'WEBHOOK_STAMP_PATH': os.path.join(self.workdir, 'webhook.stamp'),
+            'BLOB_CACHE_DIR': '',
+            'ARCHIVE_INTERVAL': '0',
+            'GITEE_CASSETTE_MODE': '',
+            'PYTHONUNBUFFERED': '1'
+        })
+        # 压测不应被请求预算限速，需要时可以用 --env 覆盖
+        env.setdefault('GITEE_RATE_LIMIT', '100000000')
+        env.setdefault('GITEE_RATE_BURST', '100000')
+        for item in self.args.env or []:
+            name, _, value = item.partition('=')
+            env[name] = value
+        return env
+
+    def start(self):
+        self._log = open(self.log_path, 'w', encoding='utf-8')
+        self.process = subprocess.Popen(self.command(), cwd=ROOT, env=self.environment(),
+                                        stdout=self._log, stderr=subprocess.STDOUT)
+        # 第一次获取列表会触发冷扫描，成功返回后才开始计时
+        deadline = time.monotonic() + self.args.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if requests.get(f"{self.base_url}/api/requests", timeout=self.args.startup_timeout).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"gunicorn启动失败，日志: {self.log_path}")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            # SIGTERM让gunicorn等待正在处理的请求完成后退出
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=self.args.worker_timeout + 5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+        if getattr(self, '_log', None):
+            self._log.close()
+            self._log = None
+
+
+class MachineCodes:
+    """压测期间逐个分配pending请求的机器码，每个请求只批准或拒绝一次"""
+
+    def __init__(self, pending):
+        self.pending = pending
+        self.next_index = 0
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.next_index >= self.pending:
+                self.exhausted += 1
+                return None
+            index = self.next_index
+            self.next_index += 1
+        return f"BENCH{index:06d}"
+
+
+class VirtualClient(threading.Thread):
+    """按流量比例循环发请求的虚拟客户端，与页面一样带上一次的ETag获取列表"""
+
+    def __init__(self, server, mix, machine_codes, samples, stop, args, seed):
+        super().__init__(daemon=True)
+        self.server = server
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.machine_codes = machine_codes
+        self.samples = samples
+        self.stop_event = stop
+        self.args = args
+        self.random = random.Random(seed)
+        self.session = requests.Session()
+        self.etag = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            operation = self.random.choices(self.operations, self.weights)[0]
+            started = time.perf_counter()
+            status, error, server_ms = self.call(operation)
+            finished = time.perf_counter()
+            self.samples.append((operation, started, finished, status, error, server_ms))
+            if self.args.think_ms > 0:
+                self.stop_event.wait(self.random.expovariate(1000.0 / self.args.think_ms))
+        self.session.close()
+
+    def call(self, operation):
+        """返回 (状态码, 错误类型或None, 服务端处理耗时毫秒)"""
+        url = self.server.base_url
+        machine_code = None
+        if operation in ('approve', 'reject'):
+            machine_code = self.machine_codes.take()
+            if machine_code is None:
+                # pending请求已经用完，改为获取列表（结果中会统计用完的次数）
+                operation = 'requests'
+        try:
+            if operation == 'requests':
+                headers = {'If-None-Match': self.etag} if self.etag and not self.args.no_conditional else {}
+                response = self.session.get(f"{url}/api/requests", headers=headers, timeout=self.args.timeout)
+                if response.status_code == 200:
+                    self.etag = response.headers.get('ETag')
+                ok = response.status_code in (200, 304)
+            elif operation == 'sync':
+                response = self.session.post(f"{url}/api/sync", timeout=self.args.timeout)
+                ok = response.status_code == 200
+            elif operation == 'approve':
+                response = self.session.post(f"{url}/api/approve", timeout=self.args.timeout,
+                                             json={"machine_code": machine_code, "expire_hours": 720})
+                ok = response.status_code in (200, 202)
+            else:
+                response = self.session.post(f"{url}/api/reject", timeout=self.args.timeout,
+                                             json={"machine_code": machine_code, "reason": "load test"})
+                ok = response.status_code in (200, 202)
+        except requests.Timeout:
+            return None, 'timeout', None
+        except requests.ConnectionError:
+            return None, 'connection', None
+
+        match = SERVER_TIMING_RE.search(response.headers.get('Server-Timing', ''))
+        server_ms = float(match.group(1)) if match else None
+        error = None if ok else f"http_{response.status_code}"
+        return response.status_code, error, server_ms
+
+
+def latency_stats(values):
+    ordered = sorted(values)
+
+    def ms(value):
+        return round(value, 3) if value is not None else None
+
+    return {
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else None,
+        "max_ms": ms(ordered[-1]) if ordered else None
+    }
+
+
+def summarize_step(clients, samples, measure_start, measure_end):
+    """只统计在计时窗口内开始并完成的请求，时间单位为毫秒"""
+    window = [s for s in samples if s[1] >= measure_start and s[2] <= measure_end]
+    elapsed = measure_end - measure_start
+    errors = Counter(s[4] for s in window if s[4])
+    latencies = [(s[2] - s[1]) * 1000 for s in window]
+    server = [s[5] for s in window if s[5] is not None]
+    queue = [max(0.0, (s[2] - s[1]) * 1000 - s[5]) for s in window if s[5] is not None]
+
+    per_operation = {}
+    grouped = defaultdict(list)
+    for sample in window:
+        grouped[sample[0]].append(sample)
+    for operation, items in sorted(grouped.items()):
+        per_operation[operation] = {
+            "requests": len(items),
+            "errors": sum(1 for s in items if s[4]),
+            **latency_stats([(s[2] - s[1]) * 1000 for s in items])
+        }
+
+    return {
+        "clients": clients,
+        "requests": len(window),
+        "throughput_per_s": round(len(window) / elapsed, 3) if elapsed > 0 else None,
+        "error_rate": round(sum(errors.values()) / len(window), 4) if window else None,
+        "errors": dict(errors),
+        "latency": latency_stats(latencies),
+        "server_time": latency_stats(server),
+        "queueing_delay": latency_stats(queue),
+        "operations": per_operation
+    }
+
+
+def run_step(server, mix, machine_codes, clients, args):
+    """clients个虚拟客户端运行 warmup + duration 秒，返回这一级的统计"""
+    samples = []
+    stop = threading.Event()
+    threads = [VirtualClient(server, mix, machine_codes, samples, stop, args, seed=args.seed * 100003 + i)
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    measure_start = time.perf_counter() + args.warmup
+    measure_end = measure_start + args.duration
+    time.sleep(max(0.0, measure_end - time.perf_counter()))
+    stop.set()
+    for thread in threads:
+        thread.join(args.timeout + 1)
+    return summarize_step(clients, samples, measure_start, measure_end)
+
+
+def find_saturation(steps, args):
+    """饱和点：吞吐量首次达到峰值95%时的客户端数；
+    另外报告p95超过SLO或错误率超过上限的第一级"""
+    measured = [step for step in steps if step['throughput_per_s']]
+    if not measured:
+        return {}
+    peak = max(step['throughput_per_s'] for step in measured)
+    knee = next(step for step in measured if step['throughput_per_s'] >= peak * 0.95)
+    breach = next((step for step in measured
+                   if (step['latency']['p95_ms'] or 0) > args.slo_ms
+                   or (step['error_rate'] or 0) > args.max_error_rate), None)
+    return {
+        "peak_throughput_per_s": peak,
+        "saturation_clients": knee['clients'],
+        "saturation_p95_ms": knee['latency']['p95_ms'],
+        "slo_breach_clients": breach['clients'] if breach else None
+    }
+
+
+def run_config(worker_class, workers, args, mix):
+    """一种worker配置下逐级加压，每种配置使用新的码云替身和新的服务进程"""
+    label = f"{worker_class} x{workers}" + (f" ({args.threads} threads)" if worker_class == 'gthread' else "")
+    print(f"\n{label}")
+    workdir = tempfile.mkdtemp(prefix='mobile-auth-load-')
+    fake = FakeGiteeProcess(args)
+    api_base = fake.start()
+    server = GunicornServer(worker_class, workers, args, api_base, workdir)
+    machine_codes = MachineCodes(fake.pending)
+    steps = []
+    try:
+        server.start()
+        for clients in args.client_steps:
+            step = run_step(server, mix, machine_codes, clients, args)
+            steps.append(step)
+            print(f"  客户端 {clients:>4}  {step['throughput_per_s']:>9}/s  "
+                  f"p50 {step['latency']['p50_ms']:>9} ms  p95 {step['latency']['p95_ms']:>9} ms  "
+                  f"排队p95 {step['queueing_delay']['p95_ms']:>9} ms  错误率 {step['error_rate']}")
+    finally:
+        server.stop()
+        fake.stop()
+
+    saturation = find_saturation(steps, args)
+    if saturation:
+        print(f"  峰值吞吐 {saturation['peak_throughput_per_s']}/s，"
+              f"饱和于 {saturation['saturation_clients']} 个客户端，"
+              f"超出SLO于 {saturation['slo_breach_clients'] or '-'} 个客户端")
+    if machine_codes.exhausted:
+        print(f"  pending请求已用完 {machine_codes.exhausted} 次（改为获取列表），可以增大 --files")
+    return {
+        "worker_class": worker_class,
+        "workers": workers,
+        "threads": args.threads if worker_class == 'gthread' else 1,
+        "steps": steps,
+        "saturation": saturation,
+        "pending_exhausted": machine_codes.exhausted,
+        "log": server.log_path
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="gunicorn下的移动端授权服务并发压测")
+    parser.add_argument('--worker-classes', default='sync,gthread', help="gunicorn worker类型，逗号分隔")
+    parser.add_argument('--workers', default='1,4', help="worker进程数，逗号分隔")
+    parser.add_argument('--threads', type=int, default=4, help="gthread每个worker的线程数")
+    parser.add_argument('--worker-connections', type=int, default=1000, help="gevent/eventlet每个worker的并发连接数")
+    parser.add_argument('--worker-timeout', type=int, default=60, help="gunicorn的worker超时（秒）")
+    parser.add_argument('--backlog', type=int, default=2048, help="gunicorn监听队列长度")
+    parser.add_argument('--clients', default='1,2,4,8,16,32,64', help="逐级增加的虚拟客户端数，逗号分隔")
+    parser.add_argument('--duration', type=float, default=10.0, help="每一级的计时时长（秒）")
+    parser.add_argument('--warmup', type=float, default=2.0, help="每一级开始计时前的预热时长（秒）")
+    parser.add_argument('--mix', default='requests=80,sync=5,approve=10,reject=5', help="各接口的流量比例")
+    parser.add_argument('--think-ms', type=float, default=0.0, help="客户端两次请求之间的平均间隔（毫秒，指数分布）")
+    parser.add_argument('--no-conditional', action='store_true', help="获取列表时不带If-None-Match")
+    parser.add_argument('--timeout', type=float, default=30.0, help="客户端请求超时（秒）")
+    parser.add_argument('--startup-timeout', type=float, default=60.0, help="等待服务启动的时间（秒）")
+    parser.add_argument('--files', type=int, default=1000, help="请求文件数量")
+    parser.add_argument('--pending-ratio', type=float, default=0.5, help="pending请求占请求文件的比例")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="码云替身每个请求的固定延迟（毫秒）")
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help="码云替身的随机附加延迟上限（毫秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="码云替身返回502的概率")
+    parser.add_argument('--seed', type=int, default=1, help="随机种子")
+    parser.add_argument('--slo-ms', type=float, default=1000.0, help="p95延迟目标（毫秒），超过视为超出SLO")
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help="错误率上限，超过视为超出SLO")
+    parser.add_argument('--env', action='append', metavar='NAME=VALUE', help="传给被测服务的环境变量，可重复")
+    parser.add_argument('--output', help="结果文件路径，默认写到 benchmarks/results/")
+    parser.add_argument('--verbose', action='store_true', help="在gunicorn日志中记录访问日志")
+    args = parser.parse_args(argv)
+    args.client_steps = parse_list(args.clients, int)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mix = parse_mix(args.mix)
+    if importlib.util.find_spec('gunicorn') is None:
+        raise SystemExit("需要先安装gunicorn: pip install gunicorn")
+    if not args.client_steps or min(args.client_steps) < 1:
+        raise SystemExit("客户端数必须大于0")
+
+    configs = []
+    for worker_class in parse_list(args.worker_classes):
+        dependency = WORKER_DEPENDENCIES.get(worker_class)
+        if dependency and importlib.util.find_spec(dependency) is None:
+            print(f"跳过 {worker_class}：需要先安装 {dependency}")
+            continue
+        configs.extend((worker_class, workers) for workers in parse_list(args.workers, int))
+
+    print(f"请求文件 {args.files}，上游延迟 {args.latency_ms} ms，流量比例 {mix}，每级 {args.duration} 秒")
+    results = [run_config(worker_class, workers, args, mix) for worker_class, workers in configs]
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec='seconds'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args)
+        },
+        "results": results
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
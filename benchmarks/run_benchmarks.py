@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+离线性能基准
+用进程内的码云替身（benchmarks/fake_gitee.py）测量待处理列表扫描、批准/拒绝和Flask接口的
+p50/p95/p99延迟、吞吐量和每次操作的上游调用数，结果写成JSON，便于不同版本之间对比；
+批准/拒绝每次的上游调用数超过CALL_BUDGETS时以非0状态退出
+
+    python benchmarks/run_benchmarks.py --files 10,100,1000 --latency-ms 20 --iterations 20
+    python benchmarks/run_benchmarks.py --files 10000 --cold-iterations 1 --compare benchmarks/results/old.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fake_gitee import FakeGitee
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# 每次写入操作的上游调用数上限：改造之前单个批准/拒绝约6次（响应、请求状态、处理记录各一次读取和写入），
+# 写入路径的改动不应超过这个基线
+CALL_BUDGETS = {
+    "approve_request": 6,
+    "reject_request": 6,
+    "POST /api/approve": 6,
+    "POST /api/reject": 6
+}
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """屏蔽被测代码的print输出（扫描时每个文件都会打印一行）"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def load_app(api_base, workdir, **env):
+    """指向码云替身后导入服务模块（模块导入时读取环境变量并创建全局管理器），env为额外的环境变量"""
+    os.environ.update({
+        'STORAGE_BACKEND': 'gitee',
+        'GITEE_API_BASE': api_base,
+        'JOB_DB_PATH': os.path.join(workdir, 'write_jobs.sqlite3'),
+        'WEBHOOK_STAMP_PATH': os.path.join(workdir, 'webhook.stamp'),
+        'BLOB_CACHE_DIR': '',
+        'REFRESH_INTERVAL': '0',
+        'ARCHIVE_INTERVAL': '0',
+        'ASYNC_WRITES': '0',
+        **env
+    })
+    # 压测不应被请求预算限速，需要时可以在环境变量中覆盖
+    os.environ.setdefault('GITEE_RATE_LIMIT', '100000000')
+    os.environ.setdefault('GITEE_RATE_BURST', '100000')
+    with quiet():
+        import mobile_auth_server_clean
+    return mobile_auth_server_clean
+
+
+def reset_app(app_module):
+    """换上新的管理器和快照刷新器，相当于重启后的冷状态"""
+    manager = app_module.MobileAuthManager()
+    app_module.auth_manager = manager
+    app_module.request_refresher = app_module.RequestRefresher(
+        manager, 0, app_module.change_broadcaster, stamp=app_module.request_refresher.stamp)
+    app_module.request_archiver.manager = manager
+    return manager
+
+
+def percentile(sorted_values, pct):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(scenario, params, durations, errors, elapsed, calls, concurrency=1):
+    """单个场景的统计结果，时间单位为毫秒"""
+    ordered = sorted(durations)
+    count = len(durations)
+    upstream_total = sum(value for key, value in calls.items() if key not in ('injected_error', 'not_modified'))
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "scenario": scenario,
+        **params,
+        "iterations": count,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "mean_ms": ms(sum(ordered) / count) if count else None,
+        "max_ms": ms(ordered[-1]) if ordered else None,
+        "throughput_per_s": round(count / elapsed, 3) if elapsed > 0 else None,
+        "upstream_calls_per_op": round(upstream_total / count, 3) if count else None,
+        "upstream_calls": calls
+    }
+
+
+def measure(take_calls, operation, iterations, concurrency=1):
+    """执行operation(i)共iterations次，返回 (每次耗时, 失败次数, 总耗时, 上游调用计数)；
+    take_calls返回并清空上游调用计数，operation返回False或抛出异常都算失败"""
+    durations = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(iterations))
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            started = time.perf_counter()
+            try:
+                ok = operation(index) is not False
+            except Exception:
+                ok = False
+            duration = time.perf_counter() - started
+            with lock:
+                durations.append(duration)
+                if not ok:
+                    errors[0] += 1
+
+    take_calls()
+    started = time.perf_counter()
+    if concurrency <= 1:
+        worker()
+    else:
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    return durations, errors[0], elapsed, take_calls()
+
+
+def run_suite(app_module, fake, files, args):
+    """一个文件数量下的全部场景"""
+    params = {"files": files, "latency_ms": args.latency_ms, "error_rate": args.error_rate}
+    results = []
+
+    def record(scenario, operation, iterations, concurrency=1):
+        with quiet(not args.verbose):
+            durations, errors, elapsed, calls = measure(fake.take_calls, operation, iterations, concurrency)
+        result = summarize(scenario, params, durations, errors, elapsed, calls, concurrency)
+        results.append(result)
+        print(f"  {scenario:<32} p50 {result['p50_ms']:>9} ms  p95 {result['p95_ms']:>9} ms  "
+              f"p99 {result['p99_ms']:>9} ms  {result['throughput_per_s']:>9}/s  "
+              f"上游 {result['upstream_calls_per_op']}/次  失败 {errors}")
+
+    def seed():
+        fake.reset()
+        return fake.seed_requests(files, pending_ratio=args.pending_ratio)
+
+    print(f"\n文件数 {files}，延迟 {args.latency_ms} ms，错误率 {args.error_rate}")
+
+    # 冷扫描：每次都是新建的管理器（没有任何缓存），构造时的上游调用不计入
+    seed()
+    with quiet(not args.verbose):
+        managers = [app_module.MobileAuthManager() for _ in range(args.cold_iterations)]
+    record("get_pending_requests.cold", lambda i: bool(managers[i].fetch_pending_requests()), args.cold_iterations)
+
+    # 热扫描：同一个管理器重复扫描，只有目录列表和处理记录需要访问上游
+    manager = managers[-1]
+    record("get_pending_requests.warm", lambda i: bool(manager.fetch_pending_requests()), args.iterations)
+
+    # 批准和拒绝：每次处理一个不同的pending请求
+    machine_codes = seed()[:int(round(files * args.pending_ratio))]
+    writes = min(args.iterations, len(machine_codes) // 2)
+    with quiet(not args.verbose):
+        manager = app_module.MobileAuthManager()
+        manager.fetch_pending_requests()
+    if writes:
+        record("approve_request", lambda i: manager.approve_request(machine_codes[i])[0], writes)
+        record("reject_request", lambda i: manager.reject_request(machine_codes[writes + i], "bench")[0], writes)
+
+    # Flask接口
+    machine_codes = seed()[:int(round(files * args.pending_ratio))]
+    with quiet(not args.verbose):
+        reset_app(app_module)
+    client = app_module.app.test_client()
+
+    def get_requests(i):
+        return client.get('/api/requests').status_code == 200
+
+    record("GET /api/requests", get_requests, args.iterations)
+
+    etag = client.get('/api/requests').headers.get('ETag')
+    record("GET /api/requests (If-None-Match)",
+           lambda i: client.get('/api/requests', headers={'If-None-Match': etag}).status_code in (200, 304),
+           args.iterations)
+
+    clients = threading.local()
+
+    def get_requests_concurrent(i):
+        if not hasattr(clients, 'client'):
+            clients.client = app_module.app.test_client()
+        return clients.client.get('/api/requests').status_code == 200
+
+    record("GET /api/requests (concurrent)", get_requests_concurrent,
+           args.iterations * args.concurrency, args.concurrency)
+    record("POST /api/sync", lambda i: client.post('/api/sync').get_json().get('success') is True, args.iterations)
+
+    writes = min(args.iterations, len(machine_codes) // 2)
+    if writes:
+        record("POST /api/approve",
+               lambda i: client.post('/api/approve', json={"machine_code": machine_codes[i]}).status_code == 200,
+               writes)
+        record("POST /api/reject",
+               lambda i: client.post('/api/reject', json={"machine_code": machine_codes[writes + i],
+                                                          "reason": "bench"}).status_code == 200,
+               writes)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """与之前的结果按 (场景, 文件数) 对比，返回变慢超过threshold倍或上游调用变多的场景数"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(item['scenario'], item['files']): item for item in json.load(f)['results']}
+
+    regressions = 0
+    print(f"\n与 {baseline_path} 对比（p95比例 / 每次上游调用数变化）:")
+    for item in results:
+        old = baseline.get((item['scenario'], item['files']))
+        if old is None or not old.get('p95_ms') or item['p95_ms'] is None:
+            continue
+        ratio = item['p95_ms'] / old['p95_ms']
+        calls_delta = (item['upstream_calls_per_op'] or 0) - (old.get('upstream_calls_per_op') or 0)
+        regressed = ratio > threshold or calls_delta > 0.5
+        regressions += regressed
+        print(f"  {'!!' if regressed else '  '} {item['scenario']:<32} 文件数 {item['files']:<6} "
+              f"p95 x{ratio:.2f}  上游 {calls_delta:+.2f}/次")
+    return regressions
+
+
+def check_call_budgets(results):
+    """返回每次上游调用数超过CALL_BUDGETS的场景数"""
+    exceeded = 0
+    for item in results:
+        budget = CALL_BUDGETS.get(item['scenario'])
+        if budget is None or item['upstream_calls_per_op'] is None or item['upstream_calls_per_op'] <= budget:
+            continue
+        exceeded += 1
+        print(f"  !! {item['scenario']:<32} 文件数 {item['files']:<6} "
+              f"上游 {item['upstream_calls_per_op']}/次，超过上限 {budget}/次")
+    return exceeded
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="移动端授权服务离线性能基准")
+    parser.add_argument('--files', default='10,100,1000',
+                        help="请求文件数量，逗号分隔（10到10000）")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="码云替身每个请求的固定延迟（毫秒）")
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help="码云替身的随机附加延迟上限（毫秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="码云替身返回502的概率")
+    parser.add_argument('--pending-ratio', type=float, default=0.5, help="pending请求占请求文件的比例")
+    parser.add_argument('--iterations', type=int, default=20, help="每个场景的执行次数")
+    parser.add_argument('--cold-iterations', type=int, default=3, help="冷扫描的执行次数")
+    parser.add_argument('--concurrency', type=int, default=8, help="并发场景的线程数")
+    parser.add_argument('--seed', type=int, default=1, help="延迟和错误注入的随机种子")
+    parser.add_argument('--output', help="结果文件路径，默认写到 benchmarks/results/")
+    parser.add_argument('--compare', help="与之前的结果文件对比")
+    parser.add_argument('--threshold', type=float, default=1.2, help="p95变慢超过这个倍数视为退化")
+    parser.add_argument('--verbose', action='store_true', help="显示被测代码的输出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    file_counts = [int(value) for value in args.files.split(',') if value.strip()]
+    if any(count < 1 or count > 10000 for count in file_counts):
+        raise SystemExit("请求文件数量必须在1到10000之间")
+
+    fake = FakeGitee(latency=args.latency_ms / 1000.0, jitter=args.jitter_ms / 1000.0,
+                     error_rate=args.error_rate, seed=args.seed)
+    api_base = fake.start()
+    workdir = tempfile.mkdtemp(prefix='mobile-auth-bench-')
+    try:
+        app_module = load_app(api_base, workdir)
+        results = []
+        for count in file_counts:
+            results.extend(run_suite(app_module, fake, count, args))
+    finally:
+        fake.stop()
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec='seconds'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+            "config": {
+                "fetch_concurrency": app_module.FETCH_CONCURRENCY,
+                "snapshot_fresh_seconds": app_module.SNAPSHOT_FRESH_SECONDS,
+                "gitee_max_retries": app_module.GITEE_MAX_RETRIES
+            }
+        },
+        "results": results
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {output}")
+
+    exceeded = check_call_budgets(results)
+    if exceeded:
+        print(f"{exceeded} 个场景的上游调用数超过上限")
+        return 1
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"{regressions} 个场景出现退化")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
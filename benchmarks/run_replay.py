@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+用录制的码云流量做离线性能测试
+先在线上以 GITEE_CASSETTE_MODE=record 运行服务录制cassette，再在本地回放：
+
+    python benchmarks/run_replay.py --cassette gitee_cassette.jsonl --scale 1 --iterations 20
+    python benchmarks/run_replay.py --cassette gitee_cassette.jsonl --scale 0 --compare benchmarks/results/old.json
+
+回放只覆盖读取路径（扫描和列表接口）；写入的响应可以回放，但仓库状态不会随之变化
+"""
+
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.run_benchmarks import (RESULTS_DIR, quiet, load_app, reset_app, measure, summarize,
+                                       compare, git_revision)
+from gitee_cassette import take_replay_stats
+
+
+def take_calls():
+    """回放计数：served为cassette返回的响应数，misses为没有匹配记录的请求数"""
+    stats = take_replay_stats()
+    return {"served": stats.get("served", 0), "misses": stats.get("misses", 0)}
+
+
+def run_replay(app_module, args):
+    params = {"files": os.path.basename(args.cassette), "latency_ms": f"x{args.scale}", "error_rate": None}
+    results = []
+
+    def record(scenario, operation, iterations):
+        with quiet(not args.verbose):
+            durations, errors, elapsed, calls = measure(take_calls, operation, iterations)
+        result = summarize(scenario, params, durations, errors, elapsed, calls)
+        # cassette未命中的请求不算上游调用
+        count = result['iterations']
+        result['upstream_calls_per_op'] = round(calls['served'] / count, 3) if count else None
+        results.append(result)
+        print(f"  {scenario:<28} p50 {result['p50_ms']:>9} ms  p95 {result['p95_ms']:>9} ms  "
+              f"p99 {result['p99_ms']:>9} ms  {result['throughput_per_s']:>9}/s  "
+              f"回放 {result['upstream_calls_per_op']}/次  未命中 {calls['misses']}  失败 {errors}")
+
+    # 每个新管理器都有自己的回放会话，从cassette的第一条记录重新开始
+    with quiet(not args.verbose):
+        managers = [app_module.MobileAuthManager() for _ in range(args.cold_iterations)]
+    record("get_pending_requests.cold", lambda i: bool(managers[i].fetch_pending_requests()), args.cold_iterations)
+    manager = managers[-1]
+    record("get_pending_requests.warm", lambda i: bool(manager.fetch_pending_requests()), args.iterations)
+
+    with quiet(not args.verbose):
+        reset_app(app_module)
+    client = app_module.app.test_client()
+    record("GET /api/requests", lambda i: client.get('/api/requests').status_code == 200, args.iterations)
+    record("POST /api/sync", lambda i: client.post('/api/sync').get_json().get('success') is True, args.iterations)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="回放录制的码云流量做性能测试")
+    parser.add_argument('--cassette', required=True, help="GITEE_CASSETTE_MODE=record 录制的文件")
+    parser.add_argument('--scale', type=float, default=1.0, help="回放耗时的缩放比例，1为原始耗时，0为不等待")
+    parser.add_argument('--iterations', type=int, default=20, help="每个场景的执行次数")
+    parser.add_argument('--cold-iterations', type=int, default=3, help="冷扫描的执行次数")
+    parser.add_argument('--output', help="结果文件路径，默认写到 benchmarks/results/")
+    parser.add_argument('--compare', help="与之前的回放结果对比")
+    parser.add_argument('--threshold', type=float, default=1.2, help="p95变慢超过这个倍数视为退化")
+    parser.add_argument('--verbose', action='store_true', help="显示被测代码的输出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.cassette):
+        raise SystemExit(f"cassette文件不存在: {args.cassette}")
+
+    workdir = tempfile.mkdtemp(prefix='mobile-auth-replay-')
+    # 匹配只看路径和参数，api_base保持线上默认值，录制和回放的路径一致
+    app_module = load_app(os.environ.get('GITEE_API_BASE', "https://gitee.com/api/v5"), workdir,
+                          GITEE_CASSETTE_MODE='replay',
+                          GITEE_CASSETTE_PATH=os.path.abspath(args.cassette),
+                          GITEE_REPLAY_SCALE=str(args.scale))
+    take_replay_stats()
+    print(f"回放 {args.cassette}，耗时比例 {args.scale}")
+    results = run_replay(app_module, args)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec='seconds'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args)
+        },
+        "results": results
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"replay-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+码云流量录制与回放
+录制模式把GiteeClient实际发出的每个请求和收到的响应（去掉token）逐条追加到cassette文件（JSON Lines）；
+回放模式按记录返回响应，并按原始耗时或缩放后的耗时等待，不访问网络
+"""
+
+import json
+import time
+import threading
+import urllib.parse
+from datetime import timedelta
+from collections import Counter, defaultdict
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# 录制的响应头，其余（Set-Cookie等）不保存
+KEPT_RESPONSE_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Retry-After', 'Date',
+                         'X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset')
+# 录制的请求头（条件请求相关）
+KEPT_REQUEST_HEADERS = ('If-None-Match', 'If-Modified-Since')
+
+# 所有回放会话共用的计数，压测脚本用它统计每次操作的上游调用数
+_replay_stats = Counter()
+_replay_stats_lock = threading.Lock()
+
+
+class CassetteMiss(requests.ConnectionError):
+    """回放时cassette中没有与请求匹配的记录"""
+
+
+def interaction_key(method, url, params=None):
+    """请求的匹配键：方法 + 路径 + 排序后的查询参数（不含access_token和主机名，录制和回放的api_base可以不同）"""
+    parsed = urllib.parse.urlparse(url)
+    query = urllib.parse.parse_qsl(parsed.query) + [(k, str(v)) for k, v in (params or {}).items()]
+    query = sorted((k, v) for k, v in query if k != 'access_token')
+    key = f"{method.upper()} {parsed.path}"
+    return f"{key}?{urllib.parse.urlencode(query)}" if query else key
+
+
+def take_replay_stats():
+    """返回并清空回放计数（served、misses）"""
+    with _replay_stats_lock:
+        stats = dict(_replay_stats)
+        _replay_stats.clear()
+    return stats
+
+
+def _count(key):
+    with _replay_stats_lock:
+        _replay_stats[key] += 1
+
+
+class RecordingSession:
+    """包装requests.Session，把实际的请求和响应追加写入cassette文件"""
+
+    def __init__(self, session, path, redact):
+        self.session = session
+        self.path = path
+        # 去掉token等敏感信息的函数（通常是GiteeClient.redact）
+        self.redact = redact
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def request(self, method, url, params=None, json=None, headers=None, timeout=None, **kwargs):
+        record = {
+            "at": round(time.monotonic() - self._started, 6),
+            "key": self.redact(interaction_key(method, url, params)),
+            "request": {
+                "headers": {name: headers[name] for name in KEPT_REQUEST_HEADERS if headers and name in headers},
+                "json": self._sanitize(json)
+            }
+        }
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, url, params=params, json=json, headers=headers,
+                                            timeout=timeout, **kwargs)
+        except requests.RequestException as e:
+            record.update({"elapsed": round(time.monotonic() - started, 6),
+                           "error": type(e).__name__, "message": self.redact(e)})
+            self._write(record)
+            raise
+
+        record.update({
+            "elapsed": round(time.monotonic() - started, 6),
+            "status": response.status_code,
+            "headers": {name: response.headers[name] for name in KEPT_RESPONSE_HEADERS if name in response.headers},
+            "body": self.redact(response.text)
+        })
+        self._write(record)
+        return response
+
+    def _sanitize(self, payload):
+        if payload is None:
+            return None
+        payload = {k: v for k, v in payload.items() if k != 'access_token'}
+        return json.loads(self.redact(json.dumps(payload, ensure_ascii=False)))
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+            self.recorded += 1
+
+
+class ReplaySession:
+    """按cassette返回响应的假Session：同一个匹配键的记录按录制顺序依次返回，用完后重复最后一条；
+    scale为耗时的缩放比例（1为原始耗时，0为不等待）"""
+
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, path, scale=1.0):
+        self.path = path
+        self.scale = scale
+        self.headers = CaseInsensitiveDict()
+        self._queues = defaultdict(list)
+        for record in self._load(path):
+            self._queues[record['key']].append(record)
+        self._positions = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _load(cls, path):
+        """同一个文件只解析一次（每个新建的管理器都会创建自己的回放会话）"""
+        with cls._cache_lock:
+            if path not in cls._cache:
+                with open(path, encoding='utf-8') as f:
+                    cls._cache[path] = [json.loads(line) for line in f if line.strip()]
+            return cls._cache[path]
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def close(self):
+        pass
+
+    def request(self, method, url, params=None, json=None, headers=None, timeout=None, **kwargs):
+        key = interaction_key(method, url, params)
+        with self._lock:
+            records = self._queues.get(key)
+            if not records:
+                record = None
+            else:
+                record = records[min(self._positions[key], len(records) - 1)]
+                self._positions[key] += 1
+        if record is None:
+            _count("misses")
+            raise CassetteMiss(f"cassette中没有匹配的记录: {key}")
+        _count("served")
+
+        delay = record.get('elapsed', 0) * self.scale
+        limit = timeout[-1] if isinstance(timeout, tuple) else timeout
+        if limit is not None and delay > limit:
+            # 录制时的耗时超过本次的超时（例如被时间预算截短），与真实请求一样超时
+            time.sleep(limit)
+            raise requests.Timeout(f"回放耗时 {delay:.3f} 秒超过超时 {limit} 秒: {key}")
+        if delay > 0:
+            time.sleep(delay)
+
+        if 'error' in record:
+            error_class = getattr(requests.exceptions, record['error'], None)
+            if not (isinstance(error_class, type) and issubclass(error_class, requests.RequestException)):
+                error_class = requests.ConnectionError
+            raise error_class(record.get('message', ''))
+
+        response = requests.Response()
+        response.status_code = record['status']
+        response._content = record.get('body', '').encode('utf-8')
+        response.headers = CaseInsensitiveDict(record.get('headers') or {})
+        response.encoding = 'utf-8'
+        response.url = url
+        response.reason = "Replayed"
+        response.elapsed = timedelta(seconds=delay)
+        return response
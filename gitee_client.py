@@ -0,0 +1,594 @@
+# -*- coding: utf-8 -*-
+"""
+码云API客户端
+所有上游请求共享一个带连接池的requests.Session，握手成本每个进程只付一次
+"""
+
+import hmac
+import time
+import base64
+import random
+import hashlib
+import urllib.parse
+import threading
+import contextvars
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+
+# 幂等请求在超时/连接失败/5xx时重试；写请求只在确定未送达或网关错误时重试
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+WRITE_RETRY_STATUS_CODES = {502, 503, 504}
+
+# 请求优先级：写入 > 交互读取 > 后台刷新
+PRIORITY_WRITE = "write"
+PRIORITY_READ = "read"
+PRIORITY_BACKGROUND = "background"
+
+_current_priority = contextvars.ContextVar('gitee_priority', default=None)
+
+# 当前HTTP请求访问码云的截止时间（time.monotonic()），None表示不限制
+_current_deadline = contextvars.ContextVar('gitee_deadline', default=None)
+
+# 乐观写入失败后需要重新获取sha的状态码（码云对sha不匹配/文件已存在返回400）
+CONFLICT_STATUS_CODES = {400, 409, 422}
+
+
+def git_blob_sha(text):
+    """计算内容的git blob sha，与码云返回的sha一致"""
+    data = text.encode('utf-8') if isinstance(text, str) else text
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def verify_webhook(secret, token, timestamp=None, max_skew=3600):
+    """校验码云webhook，返回 (是否通过, 原因)
+    密码方式: X-Gitee-Token 等于密码；签名方式: X-Gitee-Token 为
+    urlencode(base64(HmacSHA256(secret, "{timestamp}\n{secret}")))，timestamp为毫秒"""
+    if not secret:
+        return False, "未配置webhook密钥"
+    if not token:
+        return False, "缺少X-Gitee-Token"
+    if not isinstance(token, str):
+        return False, "X-Gitee-Token格式错误"
+    # compare_digest只接受ASCII字符串，按UTF-8字节比较，请求头带非ASCII字符时返回校验失败而不是抛异常
+    if hmac.compare_digest(token.encode('utf-8'), secret.encode('utf-8')):
+        return True, "密码校验通过"
+    if not timestamp:
+        return False, "密码不匹配"
+
+    try:
+        sent_at = int(timestamp) / 1000
+    except ValueError:
+        return False, "时间戳格式错误"
+    if abs(time.time() - sent_at) > max_skew:
+        return False, "时间戳超出允许范围，可能是重放请求"
+
+    digest = hmac.new(secret.encode('utf-8'), f"{timestamp}\n{secret}".encode('utf-8'), hashlib.sha256).digest()
+    expected = base64.b64encode(digest).decode('ascii')
+    if hmac.compare_digest(urllib.parse.unquote(token).encode('utf-8'), expected.encode('utf-8')):
+        return True, "签名校验通过"
+    return False, "签名不匹配"
+
+
+class RateLimitExceeded(requests.RequestException):
+    """请求预算不足，请求被推迟后仍无法发出或被直接丢弃"""
+
+
+class DeadlineExceeded(requests.RequestException):
+    """当前HTTP请求的时间预算已用完，不再发出码云请求"""
+
+
+@contextmanager
+def request_deadline(seconds):
+    """在上下文中发出的码云请求共享seconds秒的总时间预算，seconds为0或None时不限制"""
+    token = _current_deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _current_deadline.reset(token)
+
+
+def deadline_remaining():
+    """当前时间预算的剩余秒数，未设置预算时返回None"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextmanager
+def request_priority(priority):
+    """在上下文中发出的码云请求使用指定优先级（线程池任务需要用contextvars.copy_context传递）"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class RateBudget:
+    """按token的请求预算（令牌桶），并用码云返回的限流响应头校准"""
+
+    def __init__(self, per_hour=5000, burst=100, background_reserve=0.3, read_max_wait=2.0):
+        self.rate = per_hour / 3600.0
+        self.capacity = float(burst)
+        self.background_reserve = background_reserve * self.capacity
+        self.read_max_wait = read_max_wait
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.upstream = {"limit": None, "remaining": None, "reset": None}
+        self.stats = {"delayed": 0, "shed": 0, "rejected": 0}
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, priority):
+        """取一个令牌：写入总是放行（可透支），后台刷新在余量低于保留值时丢弃，交互读取最多等待read_max_wait秒"""
+        deadline = time.monotonic() + self.read_max_wait
+        with self._cond:
+            while True:
+                self._refill()
+                now = time.monotonic()
+
+                if priority == PRIORITY_WRITE:
+                    self.tokens -= 1
+                    return
+
+                blocked = self.blocked_until > now
+                if priority == PRIORITY_BACKGROUND:
+                    if blocked or self.tokens - 1 < self.background_reserve:
+                        self.stats["shed"] += 1
+                        raise RateLimitExceeded(f"请求预算不足，丢弃后台请求 (剩余 {self.tokens:.1f})")
+                    self.tokens -= 1
+                    return
+
+                if not blocked and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (self.blocked_until - now) if blocked else (1 - self.tokens) / self.rate
+                if now + wait > deadline:
+                    self.stats["rejected"] += 1
+                    raise RateLimitExceeded(f"请求预算不足，{wait:.1f} 秒后才有余量")
+                self.stats["delayed"] += 1
+                self._cond.wait(wait)
+
+    def observe(self, response):
+        """根据响应头和限流状态码校准预算"""
+        headers = response.headers
+        limit = headers.get('X-RateLimit-Limit')
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        retry_after = headers.get('Retry-After')
+
+        with self._cond:
+            self._refill()
+            if limit is not None:
+                self.upstream["limit"] = _to_int(limit)
+            if remaining is not None and _to_int(remaining) is not None:
+                self.upstream["remaining"] = _to_int(remaining)
+                self.tokens = min(self.tokens, float(self.upstream["remaining"]))
+            if reset is not None:
+                self.upstream["reset"] = _to_int(reset)
+
+            if response.status_code in (403, 429) and (self.upstream["remaining"] == 0 or retry_after):
+                wait = _to_int(retry_after) if retry_after else None
+                if wait is None and self.upstream["reset"]:
+                    reset_at = self.upstream["reset"]
+                    # 兼容绝对时间戳和相对秒数两种写法
+                    wait = reset_at - time.time() if reset_at > 10 ** 9 else reset_at
+                wait = max(1, wait or 60)
+                self.blocked_until = time.monotonic() + wait
+                self.tokens = min(self.tokens, 0.0)
+                print(f"码云限流，暂停非写入请求 {wait} 秒")
+
+    def status(self):
+        with self._cond:
+            self._refill()
+            now = time.monotonic()
+            return {
+                "tokens": round(self.tokens, 1),
+                "capacity": self.capacity,
+                "refill_per_second": round(self.rate, 3),
+                "background_reserve": self.background_reserve,
+                "blocked_seconds": round(max(0.0, self.blocked_until - now), 1),
+                "upstream": dict(self.upstream),
+                "stats": dict(self.stats)
+            }
+
+
+class CircuitOpenError(requests.RequestException):
+    """熔断器打开，请求未发出直接失败"""
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，reset_timeout秒后放行一个探测请求，成功则恢复"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """请求前检查，熔断期间直接抛出CircuitOpenError；返回本次请求是否为半开状态的探测请求，
+        探测请求必须以record_success、record_failure或release_probe结束"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                print("码云熔断器半开，放行探测请求")
+                return True
+            raise CircuitOpenError(f"码云熔断中，{max(0.0, remaining):.0f} 秒后重试 (最近错误: {self.last_error})")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print("码云熔断器恢复")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """探测请求没有得到上游的结果（例如被请求预算丢弃），归还探测名额，状态不变"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"码云连续失败 {self.failures} 次，熔断 {self.reset_timeout} 秒: {error}")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def status(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "last_error": self.last_error,
+                "retry_in": round(max(0.0, self.opened_at + self.reset_timeout - time.monotonic()), 1)
+                if self.state == self.OPEN else 0
+            }
+
+
+def _to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class GiteeClient:
+    """线程安全的码云API客户端"""
+
+    def __init__(self, token, repo, api_base="https://gitee.com/api/v5",
+                 pool_size=10, max_retries=2, backoff=0.5, max_backoff=8.0, budget=None, breaker=None):
+        self.token = token
+        self.repo = repo
+        self.api_base = api_base
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget or RateBudget()
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        # 重试由本类自己处理，底层适配器不重试
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'User-Agent': 'Mobile-Auth-Manager/1.0',
+            'Connection': 'keep-alive'
+        })
+
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "errors": 0, "deadline_exceeded": 0}
+
+        # 读过或写过的文件的blob sha: path -> sha
+        self._shas = {}
+        self._sha_lock = threading.Lock()
+
+    def contents_url(self, path):
+        """文件内容API地址"""
+        return f"{self.api_base}/repos/{self.repo}/contents/{path}"
+
+    def repo_url(self, path):
+        """仓库级API地址"""
+        return f"{self.api_base}/repos/{self.repo}/{path}"
+
+    def known_sha(self, path):
+        """返回缓存的文件sha，没有时返回None"""
+        with self._sha_lock:
+            return self._shas.get(path)
+
+    def remember_sha(self, path, sha):
+        with self._sha_lock:
+            if sha:
+                self._shas[path] = sha
+            else:
+                self._shas.pop(path, None)
+
+    def write_file(self, path, content, message, branch="master", timeout=15):
+        """覆盖写入文件（content为base64），只用于内容不依赖原文件的写入（如responses/）
+
+        有缓存sha时直接PUT，没有时POST创建；遇到sha冲突或文件已存在，重新获取sha后用同样的内容再PUT一次。
+        读-改-写的调用方要用replace_file，冲突时重新读取文件再修改
+        """
+        url = self.contents_url(path)
+        data = {"content": content, "message": message, "branch": branch}
+
+        sha = self.known_sha(path)
+        if sha:
+            response = self.put(url, json=dict(data, sha=sha), timeout=timeout)
+        else:
+            response = self.post(url, json=data, timeout=timeout)
+
+        if response.status_code in (200, 201) or response.status_code not in CONFLICT_STATUS_CODES:
+            return response
+
+        print(f"写入 {path} 冲突 (状态码: {response.status_code})，重新获取sha后重试")
+        self.remember_sha(path, None)
+        fresh = self.get(url, timeout=timeout)
+        fresh_sha = self.known_sha(path) if fresh.status_code == 200 else None
+        if not fresh_sha:
+            return response
+        return self.put(url, json=dict(data, sha=fresh_sha), timeout=timeout)
+
+    def replace_file(self, path, content, message, sha, branch="master", timeout=15):
+        """条件写入（content为base64）：sha为修改所基于的文件版本，为None时要求文件不存在；
+        文件已被改动时码云返回冲突状态码，直接返回响应，不自动重试"""
+        url = self.contents_url(path)
+        data = {"content": content, "message": message, "branch": branch}
+        if sha:
+            return self.put(url, json=dict(data, sha=sha), timeout=timeout)
+        return self.post(url, json=data, timeout=timeout)
+
+    def commit_files(self, actions, message, branch="master", timeout=30):
+        """一次提交多个文件变更（码云 POST /repos/{owner}/{repo}/commits）
+
+        actions中每项为 {"action": "create"|"update"|"delete", "path": ..., "content": base64}
+        """
+        payload_actions = []
+        for action in actions:
+            item = dict(action)
+            if 'content' in item:
+                item.setdefault('encoding', 'base64')
+            payload_actions.append(item)
+
+        data = {
+            "branch": branch,
+            "message": message,
+            "actions": payload_actions
+        }
+        response = self.post(self.repo_url("commits"), json=data, timeout=timeout)
+
+        # 提交成功后按内容计算新的blob sha，后续写入无需先读取
+        if response.status_code in (200, 201):
+            for item in payload_actions:
+                if item['action'] == 'delete':
+                    self.remember_sha(item['path'], None)
+                elif 'content' in item and item.get('encoding') == 'base64':
+                    self.remember_sha(item['path'], git_blob_sha(base64.b64decode(item['content'])))
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def request(self, method, url, params=None, json=None, headers=None, timeout=15, with_token=True):
+        """发送请求，自动附带access_token，并对可重试的失败做带抖动的指数退避"""
+        method = method.upper()
+        params = dict(params or {})
+        if json is not None:
+            json = dict(json)
+
+        if with_token:
+            if json is not None:
+                json.setdefault('access_token', self.token)
+            else:
+                params.setdefault('access_token', self.token)
+
+        idempotent = method in IDEMPOTENT_METHODS
+        retry_codes = RETRY_STATUS_CODES if idempotent else WRITE_RETRY_STATUS_CODES
+        priority = PRIORITY_READ if idempotent else PRIORITY_WRITE
+        if idempotent and _current_priority.get():
+            priority = _current_priority.get()
+
+        attempt = 0
+        while True:
+            attempt_timeout = self._deadline_timeout(timeout, f"{method} {self._short_url(url)}")
+            probe = self.breaker.before_request()
+            # 探测请求在任何退出路径上都要有结论（成功、失败或归还名额），否则熔断器会一直半开
+            settled = False
+            try:
+                self.budget.acquire(priority)
+                self._count('requests')
+                try:
+                    response = self.session.request(method, url, params=params or None, json=json,
+                                                    headers=headers, timeout=attempt_timeout)
+                    self.budget.observe(response)
+                except requests.RequestException as e:
+                    # 被时间预算截短的超时不算码云故障
+                    if attempt_timeout < timeout and isinstance(e, requests.Timeout):
+                        self._count('deadline_exceeded')
+                        raise DeadlineExceeded(f"请求时间预算已用完: {method} {self._short_url(url)}") from e
+                    self.breaker.record_failure(self.redact(e))
+                    settled = True
+                    if attempt < self.max_retries and self._should_retry_exception(e, idempotent):
+                        attempt += 1
+                        self._sleep_before_retry(attempt, f"{method} {self._short_url(url)} 异常: {e}")
+                        continue
+                    self._count('errors')
+                    raise
+
+                if response.status_code >= 500:
+                    self.breaker.record_failure(f"状态码 {response.status_code}")
+                else:
+                    self.breaker.record_success()
+                settled = True
+            finally:
+                if probe and not settled:
+                    self.breaker.release_probe()
+
+            if response.status_code in retry_codes and attempt < self.max_retries:
+                attempt += 1
+                self._sleep_before_retry(attempt, f"{method} {self._short_url(url)} 状态码: {response.status_code}")
+                continue
+            self._record_shas(method, url, response)
+            return response
+
+    def _record_shas(self, method, url, response):
+        """从内容API的响应中记录文件sha（读取返回文件或目录列表，写入返回content字段）"""
+        prefix = self.contents_url('')
+        if not url.startswith(prefix) or response.status_code not in (200, 201):
+            return
+        try:
+            body = response.json()
+        except ValueError:
+            return
+
+        if method == 'GET':
+            entries = body if isinstance(body, list) else [body]
+        elif isinstance(body, dict):
+            entries = [body.get('content')]
+        else:
+            return
+
+        with self._sha_lock:
+            for entry in entries:
+                if isinstance(entry, dict) and entry.get('path') and entry.get('sha') and entry.get('type', 'file') == 'file':
+                    self._shas[entry['path']] = entry['sha']
+
+    def redact(self, error):
+        """错误信息里的URL带有access_token，对外展示前替换掉"""
+        text = str(error)
+        return text.replace(self.token, "***") if self.token else text
+
+    def _should_retry_exception(self, error, idempotent):
+        """写请求只在连接未建立时重试，避免读超时后重复提交"""
+        if idempotent:
+            return isinstance(error, (requests.Timeout, requests.ConnectionError))
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        return isinstance(error, requests.ConnectionError) and not isinstance(error, requests.ReadTimeout)
+
+    def _deadline_timeout(self, timeout, what):
+        """按剩余时间预算缩短单次请求的超时，预算已用完时抛出DeadlineExceeded"""
+        remaining = deadline_remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded(f"请求时间预算已用完，跳过 {what}")
+        return min(timeout, remaining)
+
+    def _sleep_before_retry(self, attempt, reason):
+        """指数退避加随机抖动，剩余时间预算不够等待时不再重试"""
+        delay = min(self.max_backoff, self.backoff * (2 ** (attempt - 1)))
+        delay = delay * random.uniform(0.5, 1.5)
+        remaining = deadline_remaining()
+        if remaining is not None and remaining <= delay:
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded(f"请求时间预算不足，放弃重试 ({reason})")
+        self._count('retries')
+        print(f"码云请求重试 {attempt}/{self.max_retries}，等待 {delay:.2f} 秒 ({reason})")
+        time.sleep(delay)
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _short_url(self, url):
+        return url.replace(self.api_base, '')
+
+
+class _Flight:
+    """一次进行中的调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """合并并发的相同调用：同一个key同时只执行一次，其余调用者等待并共享同一个结果；
+    跟随者最多等到自己的时间预算用完，领头调用因它自己的预算或优先级失败时，跟随者重新发起调用"""
+
+    # 由领头调用的上下文（时间预算、请求优先级）导致的错误，不代表跟随者的调用也会失败
+    CONTEXT_ERRORS = (RateLimitExceeded, DeadlineExceeded)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.stats = {"calls": 0, "shared": 0, "retried": 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            self.stats["calls"] += 1
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _Flight()
+                    self._flights[key] = flight
+                else:
+                    self.stats["shared"] += 1
+
+            if leader:
+                return self._lead(key, flight, fn, *args, **kwargs)
+
+            remaining = deadline_remaining()
+            if not flight.done.wait(None if remaining is None else max(0.0, remaining)):
+                raise DeadlineExceeded(f"等待进行中的相同调用超过请求时间预算: {key}")
+            if isinstance(flight.error, self.CONTEXT_ERRORS):
+                with self._lock:
+                    self.stats["retried"] += 1
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+    def _lead(self, key, flight, fn, *args, **kwargs):
+        try:
+            flight.result = fn(*args, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
@@ -9,6 +9,7 @@ import json
 import time
 import hashlib
 import requests
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from urllib.parse import parse_qs
 
@@ -17,6 +18,38 @@ GITEE_TOKEN = "ff0149c2c941b7bf43bca91e9fe6c8ec"
 GITEE_REPO = "chav-pikey/license-serve"
 GITEE_API_BASE = "https://gitee.com/api/v5"
 
+# 按blob sha缓存的请求文件内容，内容是否最新只由目录列表中的sha决定；
+# 函数实例可能长期复用，按LRU最多保留BLOB_CACHE_SIZE个
+BLOB_CACHE = OrderedDict()
+BLOB_CACHE_SIZE = 2000
+
+# 条件请求缓存: url -> (ETag, Last-Modified, 上次解析的响应)，函数实例复用时有效
+CONDITIONAL_CACHE = {}
+
+def conditional_get(url, timeout=15):
+    """带上次的ETag/Last-Modified请求码云，304时返回上次解析的结果，返回 (状态码, 解析后的响应)"""
+    cached = CONDITIONAL_CACHE.get(url)
+    headers = {}
+    if cached:
+        if cached[0]:
+            headers['If-None-Match'] = cached[0]
+        if cached[1]:
+            headers['If-Modified-Since'] = cached[1]
+    
+    response = requests.get(url, params={"access_token": GITEE_TOKEN}, headers=headers, timeout=timeout)
+    if response.status_code == 304 and cached:
+        return 200, cached[2]
+    if response.status_code != 200:
+        CONDITIONAL_CACHE.pop(url, None)
+        return response.status_code, None
+    
+    body = response.json()
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if etag or last_modified:
+        CONDITIONAL_CACHE[url] = (etag, last_modified, body)
+    return 200, body
+
 class MobileAuthManager:
     """移动端授权管理器"""
     
@@ -30,31 +63,9 @@ class MobileAuthManager:
         try:
             file_path = "processed_requests.json"
             url = f"{self.api_base}/repos/{GITEE_REPO}/contents/{file_path}"
+            status_code, file_info = conditional_get(url)
             
-            timestamp = int(time.time() * 1000)
-            random_suffix = f"{timestamp % 10000}"
-            
-            params = {
-                "access_token": GITEE_TOKEN,
-                "_t": timestamp,
-                "_r": random_suffix,
-                "no_cache": "1"
-            }
-            
-            headers = {
-                'Cache-Control': 'no-cache, no-store, must-revalidate, max-age=0',
-                'Pragma': 'no-cache',
-                'Expires': '-1',
-                'User-Agent': f'Mobile-Auth-Manager/1.0-{timestamp}',
-                'If-None-Match': '*',
-                'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'
-            }
-            
-            response = requests.get(url, params=params, headers=headers, timeout=15)
-            
-            if response.status_code == 200:
-                file_info = response.json()
-                
+            if status_code == 200:
                 if isinstance(file_info, dict) and 'content' in file_info:
                     content = self._base64_decode(file_info['content'])
                     try:
@@ -78,36 +89,14 @@ class MobileAuthManager:
             self.load_processed_requests()
             
             url = f"{self.api_base}/repos/{GITEE_REPO}/contents/requests"
-            timestamp = int(time.time() * 1000)
-            random_id = f"{timestamp % 100000}"
-            
-            params = {
-                "access_token": GITEE_TOKEN,
-                "_t": timestamp,
-                "_r": random_id,
-                "no_cache": "1",
-                "force_refresh": "1"
-            }
+            status_code, files = conditional_get(url)
             
-            headers = {
-                'Cache-Control': 'no-cache, no-store, must-revalidate, max-age=0, s-maxage=0, proxy-revalidate',
-                'Pragma': 'no-cache',
-                'Expires': '-1',
-                'User-Agent': f'Mobile-Auth-Manager/1.0-{timestamp}',
-                'If-None-Match': '*',
-                'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT',
-                'X-Requested-With': 'XMLHttpRequest'
-            }
-            
-            response = requests.get(url, params=params, headers=headers, timeout=15)
-            
-            if response.status_code == 200:
-                files = response.json()
+            if status_code == 200:
                 pending_requests = []
                 
                 for file_info in files:
                     if file_info['name'].endswith('.json'):
-                        file_content = self._get_file_content(file_info['download_url'])
+                        file_content = self._get_file_content(file_info['sha'])
                         if file_content:
                             try:
                                 request_data = json.loads(file_content)
@@ -305,52 +294,20 @@ class MobileAuthManager:
         except Exception as e:
             print(f"标记处理失败: {e}")
     
-    def _get_file_content(self, download_url):
-        """获取文件内容"""
+    def _get_file_content(self, sha):
+        """按blob sha获取文件内容；同一个sha的内容永远不变，函数实例复用时直接使用缓存"""
+        if sha in BLOB_CACHE:
+            BLOB_CACHE.move_to_end(sha)
+            return BLOB_CACHE[sha]
         try:
-            import urllib.parse
-            parsed = urllib.parse.urlparse(download_url)
-            
-            timestamp = int(time.time() * 1000)
-            random_suffix = f"{timestamp % 999999}"
-            
-            cache_params = [
-                f"_t={timestamp}",
-                f"_r={random_suffix}", 
-                f"no_cache=1",
-                f"force_refresh=1",
-                f"v={timestamp}"
-            ]
-            
-            cache_buster = "&".join(cache_params)
-            if parsed.query:
-                new_query = f"{parsed.query}&{cache_buster}"
-            else:
-                new_query = cache_buster
-                
-            new_url = urllib.parse.urlunparse((
-                parsed.scheme,
-                parsed.netloc,
-                parsed.path,
-                parsed.params,
-                new_query,
-                parsed.fragment
-            ))
-            
-            headers = {
-                'Cache-Control': 'no-cache, no-store, must-revalidate, max-age=0, s-maxage=0, proxy-revalidate',
-                'Pragma': 'no-cache',
-                'Expires': '-1',
-                'User-Agent': f'Mobile-Auth-Manager/1.0-{timestamp}',
-                'If-None-Match': '*',
-                'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT',
-                'X-Requested-With': 'XMLHttpRequest',
-                'Connection': 'close'
-            }
-            
-            response = requests.get(new_url, headers=headers, timeout=15)
+            url = f"{self.api_base}/repos/{GITEE_REPO}/git/blobs/{sha}"
+            response = requests.get(url, params={"access_token": GITEE_TOKEN}, timeout=15)
             if response.status_code == 200:
-                return response.text
+                content = self._base64_decode(response.json().get('content', ''))
+                BLOB_CACHE[sha] = content
+                while len(BLOB_CACHE) > BLOB_CACHE_SIZE:
+                    BLOB_CACHE.popitem(last=False)
+                return content
             else:
                 return None
         except Exception as e:
@@ -422,6 +379,11 @@ class MobileAuthManager:
         except Exception as e:
             raise Exception(f"Base64解码失败: {str(e)}")
 
+def pending_etag(requests_list):
+    """根据待处理列表内容计算稳定的ETag"""
+    body = json.dumps(requests_list, ensure_ascii=False, sort_keys=True)
+    return '"' + hashlib.sha1(body.encode('utf-8')).hexdigest()[:20] + '"'
+
 # 全局授权管理器实例
 auth_manager = MobileAuthManager()
 
@@ -502,6 +464,8 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
     
     <script>
         let isLoading = false;
+        let requestsEtag = null;
+        let requestsCount = 0;
         
         function showToast(message) {
             const toast = document.getElementById('toast');
@@ -537,10 +501,21 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             document.getElementById('statusText').textContent = '正在加载请求...';
             
             try {
-                const response = await fetch('/api/requests');
+                const headers = requestsEtag ? { 'If-None-Match': requestsEtag } : {};
+                const response = await fetch('/api/requests', { headers: headers, cache: 'no-store' });
+                
+                // 列表没有变化，保留当前显示
+                if (response.status === 304) {
+                    document.getElementById('statusText').textContent = 
+                        `共 ${requestsCount} 个待处理请求 | ${new Date().toLocaleTimeString()}`;
+                    return;
+                }
+                
                 const result = await response.json();
                 
                 if (result.success) {
+                    requestsEtag = response.headers.get('ETag');
+                    requestsCount = result.data.length;
                     displayRequests(result.data);
                     document.getElementById('statusText').textContent = 
                         `共 ${result.data.length} 个待处理请求 | ${new Date().toLocaleTimeString()}`;
@@ -549,6 +524,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
                 }
             } catch (error) {
                 console.error('加载请求失败:', error);
+                requestsEtag = null;
                 document.getElementById('statusText').textContent = '加载失败，请检查网络';
                 showToast('加载失败，请检查网络');
             } finally {
@@ -817,10 +793,25 @@ def handler(request):
         
         elif path == '/api/requests':
             requests_list = auth_manager.get_pending_requests()
+            etag = pending_etag(requests_list)
+            headers = dict(request.headers) if hasattr(request, 'headers') else {}
+            if_none_match = {k.lower(): v for k, v in headers.items()}.get('if-none-match', '')
+            
+            if etag in [tag.strip() for tag in if_none_match.split(',')]:
+                return {
+                    'statusCode': 304,
+                    'headers': {'ETag': etag, 'Cache-Control': 'no-cache'},
+                    'body': ''
+                }
+            
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json; charset=utf-8'},
-                'body': json.dumps({"success": True, "data": requests_list}, ensure_ascii=False)
+                'headers': {
+                    'Content-Type': 'application/json; charset=utf-8',
+                    'ETag': etag,
+                    'Cache-Control': 'no-cache'
+                },
+                'body': json.dumps({"success": True, "data": requests_list, "version": etag.strip('"')}, ensure_ascii=False)
             }
         
         elif path == '/api/sync' and method == 'POST':
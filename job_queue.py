@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+持久化写入队列
+批准/拒绝先写入本地SQLite立即返回，后台线程负责写码云并在失败时重试，进程重启后继续处理
+已完成的任务保留一段时间供查询进度，之后由后台线程清理
+"""
+
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """基于SQLite的写入任务队列，多个worker进程可以共享同一个数据库文件"""
+
+    # 两次清理已完成任务之间的最短间隔（秒）
+    PURGE_INTERVAL = 3600.0
+
+    def __init__(self, db_path, handler, max_attempts=5, retry_delay=5.0, poll_interval=1.0, lease=300.0,
+                 on_failed=None, retention=7 * 24 * 3600.0):
+        self.db_path = db_path
+        self.handler = handler
+        # 任务最终失败（不再重试）时的回调: on_failed(kind, payload)
+        self.on_failed = on_failed
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        # running状态超过lease秒未更新视为进程已退出，任务可被重新领取
+        self.lease = lease
+        # 已完成的任务保留retention秒后删除
+        self.retention = retention
+        self._last_purge = 0.0
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        """打开连接，退出时提交（异常时回滚）并关闭连接"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    machine_code TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    message TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    next_run_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, next_run_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs (status, updated_at)")
+
+    def enqueue(self, kind, machine_code, payload):
+        """加入队列，返回 (job_id, created, kind)；同一机器码已有未完成任务时返回已有任务的id和类型"""
+        now = time.time()
+        with self._connect() as conn:
+            # 先取得写锁再查询，多个worker进程同时为同一机器码入队时，查询和插入不会交错
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, kind FROM jobs WHERE machine_code = ? AND status IN (?, ?)",
+                (machine_code, QUEUED, RUNNING)
+            ).fetchone()
+            if row:
+                return row['id'], False, row['kind']
+
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, machine_code, payload, status, created_at, updated_at, next_run_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, machine_code, json.dumps(payload, ensure_ascii=False), QUEUED, now, now, now)
+            )
+        self._wakeup.set()
+        return job_id, True, kind
+
+    def get(self, job_id):
+        """查询任务状态，不存在时返回None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row['id'],
+            "kind": row['kind'],
+            "machine_code": row['machine_code'],
+            "status": row['status'],
+            "attempts": row['attempts'],
+            "message": row['message'],
+            "created_at": row['created_at'],
+            "updated_at": row['updated_at']
+        }
+
+    def counts(self):
+        """各状态的任务数量"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def purge(self, now=None):
+        """删除完成超过retention秒的任务，返回删除的数量"""
+        now = time.time() if now is None else now
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE status = ? AND updated_at < ?",
+                                  (DONE, now - self.retention))
+        return cursor.rowcount
+
+    def ensure_started(self):
+        """启动后台处理线程（gunicorn fork之后线程不会继承，所以每次使用前检查）"""
+        if self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="job-queue", daemon=True)
+            self._thread.start()
+            print(f"写入队列已启动: {self.db_path}")
+
+    def _claim(self):
+        """原子地领取一个到期任务（包括租约过期、处理进程已退出的任务）"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = ? AND next_run_at <= ?) OR (status = ? AND updated_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (QUEUED, now, RUNNING, now - self.lease)
+            ).fetchone()
+            if row is None:
+                return None
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE id = ? AND status = ? AND updated_at = ?",
+                (RUNNING, now, row['id'], row['status'], row['updated_at'])
+            )
+            if cursor.rowcount != 1:
+                return None  # 被其他进程抢先领取
+        if row['status'] == RUNNING:
+            print(f"恢复中断的写入任务: {row['kind']} {row['machine_code']}")
+        return row
+
+    def _finish(self, job_id, status, message, next_run_at=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, updated_at = ?, next_run_at = ? WHERE id = ?",
+                (status, message, now, next_run_at or now, job_id)
+            )
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < self.PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        try:
+            removed = self.purge(now)
+        except Exception as e:
+            print(f"清理已完成的写入任务失败: {e}")
+            return
+        if removed:
+            print(f"已清理 {removed} 个已完成的写入任务")
+
+    def _run(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"领取写入任务失败: {e}")
+                job = None
+
+            if job is None:
+                self._maybe_purge()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            self._process(job)
+
+    def _process(self, job):
+        attempts = job['attempts'] + 1
+        try:
+            success, message = self.handler(job['kind'], json.loads(job['payload']))
+        except Exception as e:
+            success, message = False, f"写入任务异常: {e}"
+
+        if success:
+            print(f"写入任务完成: {job['kind']} {job['machine_code']}")
+            self._finish(job['id'], DONE, message)
+        elif attempts >= self.max_attempts:
+            print(f"写入任务失败，已放弃: {job['kind']} {job['machine_code']} - {message}")
+            self._finish(job['id'], FAILED, message)
+            if self.on_failed is not None:
+                try:
+                    self.on_failed(job['kind'], json.loads(job['payload']))
+                except Exception as e:
+                    print(f"写入任务失败回调异常: {e}")
+        else:
+            delay = self.retry_delay * (2 ** (attempts - 1))
+            print(f"写入任务失败，{delay:.0f} 秒后重试 ({attempts}/{self.max_attempts}): {message}")
+            self._finish(job['id'], QUEUED, message, time.time() + delay)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+已处理请求账本
+按月分片保存在 processed/YYYY-MM.json，processed/_head.json 记录每个分片的blob sha，
+写入只改当月分片和头文件（带sha前提，被其他进程改动时重新加载合并），读取只下载sha变化过的分片；
+开启同步时旧的 processed_requests.json 仍然双向同步：加载时合并其中的记录，追加后写回
+"""
+
+import json
+import threading
+from datetime import datetime
+from gitee_client import git_blob_sha
+from storage import StorageError, StorageConflict
+
+LEDGER_DIR = "processed"
+HEAD_PATH = f"{LEDGER_DIR}/_head.json"
+LEGACY_PATH = "processed_requests.json"
+LEGACY_SEGMENT = "legacy.json"
+# 分片或头文件被其他进程改动时的最多提交次数
+APPEND_ATTEMPTS = 5
+
+
+class ProcessedLedger:
+    """按月分片的只追加处理记录"""
+
+    def __init__(self, storage, legacy_sync=False):
+        self.storage = storage
+        # 是否与桌面版仍在读写的旧扁平文件同步
+        self.legacy_sync = legacy_sync
+        # 旧扁平文件的内容: {"sha": blob sha, "entries": [...]}
+        self.legacy = {"sha": None, "entries": []}
+        self.head = {"version": 1, "segments": {}}
+        self.head_exists = False
+        # 已解析的头文件sha，没有变化时不再解析
+        self.head_sha = None
+        # 已下载的分片: name -> {"sha": blob sha, "entries": [...]}
+        self.segments = {}
+        self._lock = threading.Lock()
+        # 进程内的追加从生成变更到提交、更新本地状态串行执行
+        self._append_lock = threading.Lock()
+
+    def entries(self):
+        """所有已处理的请求路径"""
+        with self._lock:
+            merged = set()
+            for segment in self.segments.values():
+                merged.update(segment['entries'])
+            if self.legacy_sync:
+                merged.update(self.legacy['entries'])
+            return merged
+
+    def load(self):
+        """读取头文件并下载变化过的分片，头文件不存在时从旧的扁平文件迁移；同步时再合并旧扁平文件的记录"""
+        result = self.storage.read_file(HEAD_PATH)
+        if result is None:
+            return self._migrate_legacy()
+        loaded = self._load_head(*result)
+        if self.legacy_sync:
+            self._load_legacy()
+        return loaded
+
+    def _load_head(self, text, sha):
+        """解析头文件，只下载sha变化过的分片"""
+        sha = sha or git_blob_sha(text)
+        with self._lock:
+            if self.head_exists and sha == self.head_sha:
+                return True
+        head = json.loads(text)
+
+        with self._lock:
+            known = {name: segment['sha'] for name, segment in self.segments.items()}
+        changed = [name for name, meta in head.get('segments', {}).items() if known.get(name) != meta.get('sha')]
+        if changed:
+            print(f"处理记录分片有变化: {changed}")
+
+        fetched = {}
+        for name in changed:
+            entries = self._read_segment(name)
+            if entries is not None:
+                fetched[name] = {"sha": head['segments'][name]['sha'], "entries": entries}
+
+        with self._lock:
+            self.head = head
+            self.head_exists = True
+            # 有分片读取失败时不记录sha，下次重新检查
+            self.head_sha = sha if len(fetched) == len(changed) else None
+            self.segments.update(fetched)
+            for name in list(self.segments):
+                if name not in head.get('segments', {}):
+                    del self.segments[name]
+        return True
+
+    def build_append(self, paths):
+        """生成把paths追加到当月分片所需的文件变更，返回 (actions, state)，提交成功后调用apply(state)；
+        分片和头文件都带加载时的sha作为前提，头文件放在最后"""
+        name = f"{datetime.now():%Y-%m}.json"
+        with self._lock:
+            segment = self.segments.get(name)
+            entries = list(segment['entries']) if segment else []
+            existing = set(entries)
+            head = json.loads(json.dumps(self.head))
+            head_exists = self.head_exists
+            head_sha = self.head_sha if head_exists else None
+
+        new_entries = [path for path in paths if path not in existing]
+        if not new_entries:
+            return [], None
+        entries.extend(new_entries)
+
+        segment_text = json.dumps(entries, ensure_ascii=False, separators=(',', ':'))
+        segment_sha = git_blob_sha(segment_text)
+        head.setdefault('segments', {})[name] = {"sha": segment_sha, "count": len(entries)}
+        head['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        head_text = json.dumps(head, ensure_ascii=False, separators=(',', ':'))
+
+        actions = [
+            {
+                "action": "update" if segment else "create",
+                "path": f"{LEDGER_DIR}/{name}",
+                "content": segment_text,
+                "sha": segment['sha'] if segment else None
+            },
+            {
+                "action": "update" if head_exists else "create",
+                "path": HEAD_PATH,
+                "content": head_text,
+                "sha": head_sha
+            }
+        ]
+        state = {"head": head, "head_sha": git_blob_sha(head_text), "name": name,
+                 "segment": {"sha": segment_sha, "entries": entries}}
+        return actions, state
+
+    def apply(self, state):
+        """提交成功后更新本地状态"""
+        if state is None:
+            return
+        with self._lock:
+            self.head = state['head']
+            self.head_sha = state['head_sha']
+            self.head_exists = True
+            self.segments[state['name']] = state['segment']
+
+    def append(self, paths, message):
+        """追加记录并单独提交一次"""
+        try:
+            self.commit_append(paths, message)
+        except StorageError as e:
+            print(f"处理记录提交失败: {e}")
+            return False
+        return True
+
+    def commit_append(self, paths, message, build_actions=None):
+        """把paths追加到当月分片，连同build_actions()返回的 (其他文件变更, 结果) 作为一次提交写入，返回结果；
+        分片或头文件已被其他进程改动时重新加载，再重新调用build_actions生成变更后重试"""
+        with self._append_lock:
+            for attempt in range(APPEND_ATTEMPTS):
+                actions, result = build_actions() if build_actions else ([], None)
+                ledger_actions, state = self.build_append(paths)
+                if not actions and not ledger_actions:
+                    return result
+                try:
+                    self.storage.commit(actions + ledger_actions, message)
+                except StorageConflict as e:
+                    print(f"提交冲突，重新加载后重试 ({attempt + 1}/{APPEND_ATTEMPTS}): {e}")
+                    self.load()
+                    continue
+                self.apply(state)
+                break
+            else:
+                raise StorageConflict(f"多次提交冲突: {message}")
+        self.sync_legacy(message)
+        return result
+
+    def sync_legacy(self, message):
+        """把账本中旧扁平文件没有的记录写回 processed_requests.json（桌面版读取它）；
+        条件写入，桌面版同时修改时重新读取、合并后再写，失败只打印不影响已完成的提交"""
+        if not self.legacy_sync:
+            return True
+        try:
+            for attempt in range(3):
+                with self._lock:
+                    entries = list(self.legacy['entries'])
+                    sha = self.legacy['sha']
+                    recorded = set(entries)
+                    for segment in self.segments.values():
+                        recorded.update(segment['entries'])
+                missing = sorted(recorded - set(entries))
+                if not missing:
+                    return True
+                entries.extend(missing)
+                text = json.dumps(entries, ensure_ascii=False, indent=2)
+                if self.storage.replace_file(LEGACY_PATH, text, sha, message):
+                    with self._lock:
+                        self.legacy = {"sha": git_blob_sha(text), "entries": entries}
+                    return True
+                print(f"{LEGACY_PATH} 已被桌面版修改，重新读取后合并")
+                self._load_legacy()
+            print(f"{LEGACY_PATH} 多次写入冲突，下次追加时再同步")
+        except Exception as e:
+            print(f"同步 {LEGACY_PATH} 失败: {self.storage.redact(e)}")
+        return False
+
+    def _read_segment(self, name):
+        """下载单个分片，失败返回None（下次加载时重试）"""
+        try:
+            result = self.storage.read_file(f"{LEDGER_DIR}/{name}")
+            if result is None:
+                print(f"读取处理记录分片失败: {name} 不存在")
+                return None
+            entries = json.loads(result[0])
+            return entries if isinstance(entries, list) else None
+        except Exception as e:
+            print(f"读取处理记录分片异常: {name} - {e}")
+            return None
+
+    def _migrate_legacy(self):
+        """一次性把旧的 processed_requests.json 迁移为账本的 legacy 分片"""
+        self._load_legacy()
+        with self._lock:
+            legacy = list(self.legacy['entries'])
+        if not legacy:
+            print("处理记录账本不存在，使用空记录")
+            with self._lock:
+                self.head = {"version": 1, "segments": {}}
+                self.head_exists = False
+                self.segments = {}
+            return True
+
+        print(f"迁移旧处理记录到分片账本: {len(legacy)} 条")
+        segment_text = json.dumps(legacy, ensure_ascii=False, separators=(',', ':'))
+        segment_sha = git_blob_sha(segment_text)
+        head = {
+            "version": 1,
+            "segments": {LEGACY_SEGMENT: {"sha": segment_sha, "count": len(legacy)}},
+            "migrated_from": LEGACY_PATH,
+            "updated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        actions = [
+            {"action": "create", "path": f"{LEDGER_DIR}/{LEGACY_SEGMENT}", "content": segment_text},
+            {"action": "create", "path": HEAD_PATH,
+             "content": json.dumps(head, ensure_ascii=False, separators=(',', ':'))}
+        ]
+        self.storage.commit(actions, f"迁移处理记录到分片账本: {len(legacy)} 条")
+
+        with self._lock:
+            self.head = head
+            self.head_exists = True
+            self.segments = {LEGACY_SEGMENT: {"sha": segment_sha, "entries": legacy}}
+        return True
+
+    def _load_legacy(self):
+        """读取旧的扁平处理记录，sha没有变化时跳过解析；文件无法读取时保留已有内容，不存在或无法解析时视为空"""
+        try:
+            result = self.storage.read_file(LEGACY_PATH)
+        except StorageError as e:
+            # 例如 processed_requests.json 是个文件夹，无法从中读取数据
+            print(f"无法读取 {LEGACY_PATH}: {e}")
+            return
+        if result is None:
+            with self._lock:
+                self.legacy = {"sha": None, "entries": []}
+            return
+
+        text, sha = result
+        sha = sha or git_blob_sha(text)
+        with self._lock:
+            if sha == self.legacy['sha']:
+                return
+        try:
+            data = json.loads(text)
+        except (ValueError, UnicodeDecodeError) as e:
+            print(f"旧处理记录解析失败: {e}")
+            data = []
+        with self._lock:
+            self.legacy = {"sha": sha, "entries": data if isinstance(data, list) else []}
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+请求索引
+requests/_index 记录每个请求文件的机器码、状态、请求时间和blob sha，
+sha与目录列表一致的文件不用下载就能知道状态，只有待处理的请求才需要读取完整内容
+"""
+
+import json
+import threading
+from datetime import datetime
+from gitee_client import git_blob_sha
+
+INDEX_PATH = "requests/_index"
+
+
+def index_entry(request_data, sha):
+    """请求文件对应的索引条目"""
+    return {
+        "machine_code": request_data.get('machine_code'),
+        "status": request_data.get('status'),
+        "request_time": request_data.get('request_time'),
+        "sha": sha
+    }
+
+
+class RequestIndex:
+    """requests/_index 的内存副本，写入时与状态变更放在同一次提交中"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        # path -> 索引条目
+        self.entries = {}
+        self.sha = None
+        self.exists = False
+        self._lock = threading.Lock()
+
+    def load(self, listed_sha=None):
+        """读取索引文件；目录列表中的sha（listed_sha）与已加载的一致时不再读取，sha没有变化时跳过解析"""
+        with self._lock:
+            if listed_sha and listed_sha == self.sha:
+                return True
+        result = self.storage.read_file(INDEX_PATH)
+        if result is None:
+            with self._lock:
+                self.entries, self.sha, self.exists = {}, None, False
+            return False
+
+        text, sha = result
+        sha = sha or git_blob_sha(text)
+        with self._lock:
+            if sha == self.sha:
+                return True
+        data = json.loads(text)
+        with self._lock:
+            self.entries = data.get('entries', {}) if isinstance(data, dict) else {}
+            self.sha = sha
+            self.exists = True
+        print(f"请求索引已加载: {len(self.entries)} 条")
+        return True
+
+    def match(self, path, sha):
+        """sha与索引一致时返回索引条目，否则返回None"""
+        with self._lock:
+            entry = self.entries.get(path)
+        if entry is None or not sha or entry.get('sha') != sha:
+            return None
+        return entry
+
+    def drift(self, file_infos):
+        """目录列表与索引不一致的文件数（新增、修改或已删除）"""
+        listed = {f['path']: f.get('sha') for f in file_infos}
+        with self._lock:
+            indexed = {path: entry.get('sha') for path, entry in self.entries.items()}
+        changed = sum(1 for path, sha in listed.items() if indexed.get(path) != sha)
+        return changed + sum(1 for path in indexed if path not in listed)
+
+    def build_update(self, changes):
+        """生成更新索引的文件变更，changes为 path -> 新条目（None表示删除），
+        返回 (actions, state)，提交成功后调用apply(state)"""
+        with self._lock:
+            entries = dict(self.entries)
+            exists = self.exists
+        for path, entry in changes.items():
+            if entry is None:
+                entries.pop(path, None)
+            else:
+                entries[path] = entry
+        return self._build(entries, exists)
+
+    def build_rebuild(self, entries):
+        """用完整的条目重建索引，返回 (actions, state)"""
+        with self._lock:
+            exists = self.exists
+        return self._build(dict(entries), exists)
+
+    def apply(self, state):
+        """提交成功后更新本地状态"""
+        if state is None:
+            return
+        with self._lock:
+            self.entries = state['entries']
+            self.sha = state['sha']
+            self.exists = True
+
+    def _build(self, entries, exists):
+        text = json.dumps({
+            "version": 1,
+            "updated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "entries": entries
+        }, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+        actions = [{"action": "update" if exists else "create", "path": INDEX_PATH, "content": text}]
+        return actions, {"entries": entries, "sha": git_blob_sha(text)}
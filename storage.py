@@ -0,0 +1,700 @@
+# -*- coding: utf-8 -*-
+"""
+存储后端
+授权管理器只通过这里的接口读写请求、响应和处理记录；码云是默认实现，
+本地文件系统实现用于离线运行、测试和压测
+"""
+
+import os
+import time
+import base64
+import threading
+import subprocess
+import urllib.parse
+from collections import OrderedDict
+from contextlib import contextmanager
+from gitee_client import git_blob_sha, deadline_remaining, DeadlineExceeded, CONFLICT_STATUS_CODES
+
+try:
+    import fcntl
+except ImportError:  # Windows本地调试时只用进程内锁
+    fcntl = None
+
+
+class StorageError(RuntimeError):
+    """存储后端返回了无法处理的结果（状态码错误、文件格式错误等）"""
+
+
+class StorageConflict(StorageError):
+    """提交时文件已不是调用方读取时的版本，调用方重新读取后再提交"""
+
+
+class StorageBackend:
+    """存储后端接口，路径都是相对仓库根目录、用/分隔的路径，文件内容都是文本
+
+    list_dir(path)                 -> [{"name", "path", "sha", "type"}]，目录不存在时返回[]
+    read_file(path)                -> (text, sha)，文件不存在时返回None
+    read_entry(entry)              -> list_dir返回的文件条目的内容
+    write_file(path, text, message) -> 是否新建了文件（覆盖写入，只用于内容不依赖原文件的写入）
+    replace_file(path, text, sha, message) -> 文件仍是sha对应的版本（sha为None时文件不存在）时写入并返回True，
+                                      已被改动时返回False，调用方重新读取后再修改
+    commit(actions, message)       -> 把多个文件变更作为一次提交写入，
+                                      actions为 [{"action": "create"/"update"/"delete", "path", "content"}]，
+                                      带"sha"的变更要求文件仍是这个版本（None为文件不存在），
+                                      否则整个提交不写入并抛出StorageConflict
+    known_sha(path)                -> 最近一次看到的文件sha，未知时返回None
+    失败时抛出StorageError（网络错误按各实现的异常类型抛出）
+    """
+
+    name = "base"
+
+    def list_dir(self, path):
+        raise NotImplementedError
+
+    def read_file(self, path):
+        raise NotImplementedError
+
+    def read_entry(self, entry):
+        result = self.read_file(entry['path'])
+        if result is None:
+            raise StorageError(f"文件不存在: {entry['path']}")
+        return result[0]
+
+    def write_file(self, path, text, message):
+        raise NotImplementedError
+
+    def replace_file(self, path, text, sha, message):
+        raise NotImplementedError
+
+    def commit(self, actions, message):
+        raise NotImplementedError
+
+    def known_sha(self, path):
+        return None
+
+    def redact(self, error):
+        """对外展示的错误信息"""
+        return str(error)
+
+    def status(self):
+        """调试信息"""
+        return {"backend": self.name}
+
+
+def encode_content(text):
+    return base64.b64encode(text.encode('utf-8')).decode('utf-8')
+
+
+def decode_content(encoded_content):
+    content_str = str(encoded_content).replace('\n', '').replace(' ', '')
+    return base64.b64decode(content_str).decode('utf-8')
+
+
+class BlobCache:
+    """按blob sha缓存文件内容；同一个sha的内容永远不变，所以缓存不需要失效，
+    内存中按LRU保留max_entries个，指定directory时同时写入磁盘，重启后继续命中"""
+
+    def __init__(self, max_entries=10000, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, sha):
+        with self._lock:
+            text = self._entries.get(sha)
+            if text is not None:
+                self._entries.move_to_end(sha)
+                self.stats["hits"] += 1
+                return text
+
+        text = self._read_disk(sha)
+        with self._lock:
+            if text is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+        self._remember(sha, text)
+        return text
+
+    def put(self, sha, text):
+        """内容与sha不一致时不缓存（下载不完整或sha来自别处）"""
+        if not sha or git_blob_sha(text) != sha:
+            return
+        self._remember(sha, text)
+        if self.directory:
+            self._write_disk(sha, text)
+
+    def status(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "directory": self.directory, **self.stats}
+
+    def _remember(self, sha, text):
+        with self._lock:
+            self._entries[sha] = text
+            self._entries.move_to_end(sha)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_path(self, sha):
+        return os.path.join(self.directory, sha[:2], sha)
+
+    def _read_disk(self, sha):
+        if not self.directory:
+            return None
+        try:
+            with open(self._disk_path(sha), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if git_blob_sha(data) != sha:
+            return None  # 文件损坏，重新下载
+        return data.decode('utf-8')
+
+    def _write_disk(self, sha, text):
+        full_path = self._disk_path(sha)
+        if os.path.exists(full_path):
+            return
+        try:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            temp_path = f"{full_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(text.encode('utf-8'))
+            os.replace(temp_path, full_path)
+        except OSError as e:
+            print(f"写入blob缓存失败: {sha} - {e}")
+
+
+class GiteeBackend(StorageBackend):
+    """码云仓库，通过contents API读写、commits API批量提交；
+    目录列表给出的文件按blob sha读取，内容缓存在BlobCache中"""
+
+    name = "gitee"
+
+    # 保存ETag/Last-Modified的URL数量上限
+    MAX_VALIDATORS = 512
+
+    def __init__(self, client, blob_cache=None):
+        self.client = client
+        self.blob_cache = blob_cache or BlobCache()
+        # url -> {"etag", "last_modified", "body": 上次解析的响应}
+        self._validators = OrderedDict()
+        self._validators_lock = threading.Lock()
+        self.conditional_stats = {"not_modified": 0, "modified": 0}
+
+    def list_dir(self, path):
+        print(f"请求文件夹列表: {path}")
+        status, files = self._get_json(self.client.contents_url(path))
+        if status == 404:
+            return []
+        if status != 200:
+            raise StorageError(f"获取{path}文件夹失败，状态码: {status}")
+
+        if not isinstance(files, list):
+            return []
+        return [{"name": f['name'], "path": f['path'], "sha": f.get('sha'), "type": f.get('type', 'file'),
+                 "download_url": f.get('download_url')} for f in files]
+
+    def read_file(self, path):
+        status, file_info = self._get_json(self.client.contents_url(path))
+        if status == 404:
+            return None
+        if status != 200:
+            raise StorageError(f"读取文件失败: {path}, 状态码: {status}")
+
+        if isinstance(file_info, list):
+            raise StorageError(f"{path} 是文件夹而不是文件")
+        if not isinstance(file_info, dict) or 'content' not in file_info:
+            raise StorageError(f"文件格式错误: {path}")
+        text = decode_content(file_info['content'])
+        self.blob_cache.put(file_info.get('sha'), text)
+        return text, file_info.get('sha')
+
+    def read_entry(self, entry):
+        """按blob sha读取文件内容，同一个sha只下载一次；内容是否最新只由目录列表中的sha决定"""
+        sha = entry.get('sha')
+        if not sha:
+            return super().read_entry(entry)
+
+        text = self.blob_cache.get(sha)
+        if text is not None:
+            return text
+
+        response = self.client.get(self.client.repo_url(f"git/blobs/{sha}"), timeout=15)
+        if response.status_code != 200:
+            raise StorageError(f"获取文件内容失败: {entry['path']}, 状态码: {response.status_code}")
+        blob = response.json()
+        if not isinstance(blob, dict) or 'content' not in blob:
+            raise StorageError(f"blob格式错误: {entry['path']}")
+        text = decode_content(blob['content'])
+        self.blob_cache.put(sha, text)
+        print(f"文件内容获取成功: {entry['path']}，长度: {len(text)} 字符")
+        return text
+
+    def write_file(self, path, text, message):
+        """已知sha时直接更新，冲突时才重新读取sha"""
+        response = self.client.write_file(path, encode_content(text), message)
+        if response.status_code not in (200, 201):
+            raise StorageError(f"写入文件失败: {path}, 状态码: {response.status_code}")
+        return response.status_code == 201
+
+    def replace_file(self, path, text, sha, message):
+        """带sha的条件写入，码云返回冲突或文件不存在时返回False"""
+        response = self.client.replace_file(path, encode_content(text), message, sha)
+        if response.status_code in (200, 201):
+            return True
+        if response.status_code in CONFLICT_STATUS_CODES or response.status_code == 404:
+            self.client.remember_sha(path, None)
+            return False
+        raise StorageError(f"写入文件失败: {path}, 状态码: {response.status_code}")
+
+    def commit(self, actions, message):
+        """commits接口本身没有sha前提，带sha的变更在提交前逐个核对（条件GET，没有变化时只返回304），
+        核对和提交之间仍有一个请求的时间窗口"""
+        for action in actions:
+            if 'sha' in action and self._current_sha(action['path']) != action['sha']:
+                raise StorageConflict(f"文件已被改动: {action['path']}")
+
+        gitee_actions = []
+        for action in actions:
+            item = {"action": action['action'], "path": action['path']}
+            if action['action'] != 'delete':
+                item['content'] = encode_content(action['content'])
+            gitee_actions.append(item)
+
+        response = self.client.commit_files(gitee_actions, message)
+        if response.status_code not in (200, 201):
+            print(f"提交失败: {response.status_code} {response.text[:200]}")
+            raise StorageError(f"提交失败，状态码: {response.status_code}")
+
+    def known_sha(self, path):
+        return self.client.known_sha(path)
+
+    def _current_sha(self, path):
+        """上游文件当前的blob sha，文件不存在时返回None"""
+        status, file_info = self._get_json(self.client.contents_url(path))
+        if status == 404:
+            return None
+        if status != 200 or not isinstance(file_info, dict):
+            raise StorageError(f"读取文件失败: {path}, 状态码: {status}")
+        return file_info.get('sha')
+
+    def redact(self, error):
+        return self.client.redact(error)
+
+    def status(self):
+        return {
+            "backend": self.name,
+            "repo": self.client.repo,
+            "api_base": self.client.api_base,
+            "token_length": len(self.client.token or ""),
+            "rate_budget": self.client.budget.status(),
+            "circuit_breaker": self.client.breaker.status(),
+            "gitee_stats": dict(self.client.stats),
+            "blob_cache": self.blob_cache.status(),
+            "conditional_requests": dict(self.conditional_stats)
+        }
+
+    def _get_json(self, url):
+        """条件GET：带上次响应的ETag/Last-Modified，304时返回上次解析的结果（调用方不要修改），
+        返回 (状态码, 解析后的响应)"""
+        with self._validators_lock:
+            cached = self._validators.get(url)
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = self.client.get(url, headers=headers or None, timeout=15)
+        if response.status_code == 304 and cached is not None:
+            with self._validators_lock:
+                self.conditional_stats["not_modified"] += 1
+                if url in self._validators:
+                    self._validators.move_to_end(url)
+            return 200, cached['body']
+        if response.status_code != 200:
+            with self._validators_lock:
+                self._validators.pop(url, None)
+            return response.status_code, None
+
+        body = response.json()
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self._validators_lock:
+            self.conditional_stats["modified"] += 1
+            if etag or last_modified:
+                self._validators[url] = {"etag": etag, "last_modified": last_modified, "body": body}
+                self._validators.move_to_end(url)
+                while len(self._validators) > self.MAX_VALIDATORS:
+                    self._validators.popitem(last=False)
+            else:
+                self._validators.pop(url, None)
+        return 200, body
+
+
+class LocalBackend(StorageBackend):
+    """本地目录，布局与码云仓库相同；写入先写临时文件再原子替换，sha按文件mtime/大小缓存"""
+
+    name = "local"
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        # path -> (mtime_ns, size, sha)
+        self._shas = {}
+        self._sha_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.stats = {"lists": 0, "reads": 0, "writes": 0, "commits": 0}
+
+    def list_dir(self, path):
+        self.stats["lists"] += 1
+        directory = self._full_path(path)
+        try:
+            scanned = sorted(os.scandir(directory), key=lambda item: item.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+        entries = []
+        for item in scanned:
+            if item.name.endswith('.tmp') or item.name.startswith('.'):
+                continue
+            entry_path = f"{path.strip('/')}/{item.name}" if path.strip('/') else item.name
+            if item.is_dir():
+                entries.append({"name": item.name, "path": entry_path, "sha": None, "type": "dir"})
+            else:
+                entries.append({"name": item.name, "path": entry_path,
+                                "sha": self._sha(entry_path, item.path, item.stat()), "type": "file"})
+        return entries
+
+    def read_file(self, path):
+        self.stats["reads"] += 1
+        full_path = self._full_path(path)
+        try:
+            with open(full_path, 'rb') as f:
+                data = f.read()
+                stat = os.fstat(f.fileno())
+        except FileNotFoundError:
+            return None
+        except IsADirectoryError:
+            raise StorageError(f"{path} 是文件夹而不是文件")
+
+        sha = git_blob_sha(data)
+        with self._sha_lock:
+            self._shas[path] = (stat.st_mtime_ns, stat.st_size, sha)
+        return data.decode('utf-8'), sha
+
+    def write_file(self, path, text, message):
+        with self._write_lock:
+            self.stats["writes"] += 1
+            full_path = self._full_path(path)
+            created = not os.path.exists(full_path)
+            self._atomic_write(path, full_path, text)
+        return created
+
+    def replace_file(self, path, text, sha, message):
+        with self._write_lock:
+            if self.known_sha(path) != sha:
+                return False
+            self.stats["writes"] += 1
+            self._atomic_write(path, self._full_path(path), text)
+        return True
+
+    def commit(self, actions, message):
+        # 先校验全部路径，避免只写入一部分
+        resolved = [(action, self._full_path(action['path'])) for action in actions]
+        with self._write_lock:
+            for action, _ in resolved:
+                if 'sha' in action and self.known_sha(action['path']) != action['sha']:
+                    raise StorageConflict(f"文件已被改动: {action['path']}")
+            self.stats["commits"] += 1
+            for action, full_path in resolved:
+                if action['action'] == 'delete':
+                    try:
+                        os.remove(full_path)
+                    except FileNotFoundError:
+                        pass
+                    with self._sha_lock:
+                        self._shas.pop(action['path'], None)
+                else:
+                    self._atomic_write(action['path'], full_path, action['content'])
+        print(f"本地提交: {message} ({len(actions)} 个文件)")
+
+    def known_sha(self, path):
+        full_path = self._full_path(path)
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+        return self._sha(path, full_path, stat)
+
+    def status(self):
+        return {"backend": self.name, "root": self.root, "stats": dict(self.stats)}
+
+    def _full_path(self, path):
+        full_path = os.path.normpath(os.path.join(self.root, path.strip('/')))
+        if full_path != self.root and not full_path.startswith(self.root + os.sep):
+            raise StorageError(f"路径超出存储目录: {path}")
+        return full_path
+
+    def _sha(self, path, full_path, stat):
+        """文件没有变化（mtime和大小相同）时复用已算出的sha"""
+        with self._sha_lock:
+            cached = self._shas.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        with open(full_path, 'rb') as f:
+            sha = git_blob_sha(f.read())
+        with self._sha_lock:
+            self._shas[path] = (stat.st_mtime_ns, stat.st_size, sha)
+        return sha
+
+    def _atomic_write(self, path, full_path, text):
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        data = text.encode('utf-8')
+        temp_path = f"{full_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, full_path)
+        stat = os.stat(full_path)
+        with self._sha_lock:
+            self._shas[path] = (stat.st_mtime_ns, stat.st_size, git_blob_sha(data))
+
+
+class GitMirrorBackend(LocalBackend):
+    """本地克隆的仓库：读取直接扫描工作区，刷新只做一次增量git fetch；
+    写入立即在本地提交，攒够push_batch个提交或等待push_interval秒后批量推送；
+    fetch失败时按退避时间继续读取本地工作区，推送失败时交给定时推送线程重试"""
+
+    name = "git"
+
+    # fetch连续失败时的最长重试间隔（秒）
+    MAX_FETCH_BACKOFF = 300.0
+
+    def __init__(self, remote_url, root, branch="master", push_batch=10, push_interval=5.0,
+                 fetch_interval=5.0, timeout=60.0):
+        super().__init__(root)
+        self.remote_url = remote_url
+        self.branch = branch
+        self.push_batch = max(1, push_batch)
+        self.push_interval = push_interval
+        self.fetch_interval = fetch_interval
+        self.timeout = timeout
+        self.last_fetch = 0.0
+        # 最近一次同步失败的时间、原因和连续失败次数，退避期间读取不再重试
+        self.fetch_failed_at = 0.0
+        self.fetch_failures = 0
+        self.last_fetch_error = None
+        self.last_push_error = None
+        self.stats.update({"fetches": 0, "local_commits": 0, "pushes": 0, "push_failures": 0})
+        # 同一工作区的git操作串行执行：进程内用RLock，多个gunicorn worker之间用文件锁
+        self._git_lock = threading.RLock()
+        self._lock_depth = 0
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+        self._env = dict(os.environ, GIT_TERMINAL_PROMPT="0",
+                         GIT_AUTHOR_NAME="MobileAuthTool", GIT_AUTHOR_EMAIL="mobile-auth@localhost",
+                         GIT_COMMITTER_NAME="MobileAuthTool", GIT_COMMITTER_EMAIL="mobile-auth@localhost")
+
+        # 锁文件放在工作区旁边，克隆之前就能加锁：同时启动的worker只有一个执行克隆，其余等待后直接使用
+        self._lock_file = open(f"{self.root}.lock", "a")
+        with self._locked():
+            if not os.path.isdir(os.path.join(self.root, ".git")):
+                print(f"克隆仓库到 {self.root} ...")
+                self._git("clone", "--quiet", "--branch", branch, remote_url, ".")
+                self.last_fetch = time.monotonic()
+            # 上次退出前没有推送的本地提交
+            self._pending = self._unpushed_count()
+        if self._pending:
+            print(f"发现 {self._pending} 个未推送的本地提交")
+            self._ensure_flusher()
+
+    def list_dir(self, path):
+        self._maybe_sync()
+        return super().list_dir(path)
+
+    def read_file(self, path):
+        self._maybe_sync()
+        return super().read_file(path)
+
+    def write_file(self, path, text, message):
+        with self._locked():
+            created = super().write_file(path, text, message)
+            self._commit_paths([path], message)
+        return created
+
+    def replace_file(self, path, text, sha, message):
+        with self._locked():
+            if not super().replace_file(path, text, sha, message):
+                return False
+            self._commit_paths([path], message)
+        return True
+
+    def commit(self, actions, message):
+        with self._locked():
+            super().commit(actions, message)
+            self._commit_paths([action['path'] for action in actions], message)
+
+    def sync(self):
+        """增量fetch并把本地未推送的提交变基到远端最新提交上，失败时记录失败时间后抛出"""
+        with self._locked():
+            try:
+                self._git("fetch", "--quiet", "origin", self.branch)
+                self._rebase()
+            except StorageError as e:
+                self.fetch_failed_at = time.monotonic()
+                self.fetch_failures += 1
+                self.last_fetch_error = str(e)
+                raise
+            self.last_fetch = time.monotonic()
+            self.fetch_failures = 0
+            self.last_fetch_error = None
+            self.stats["fetches"] += 1
+
+    def flush(self):
+        """推送所有本地提交，远端有新提交时先变基再重试"""
+        with self._locked():
+            if not self._pending:
+                return True
+            for attempt in range(3):
+                result = self._git("push", "--quiet", "origin", f"HEAD:{self.branch}", check=False)
+                if result.returncode == 0:
+                    print(f"已推送 {self._pending} 个本地提交")
+                    self._pending = 0
+                    self.last_push_error = None
+                    self.stats["pushes"] += 1
+                    return True
+                self.last_push_error = self.redact(result.stderr.strip())
+                print(f"推送失败，重新同步后重试 ({attempt + 1}/3): {self.last_push_error}")
+                self.sync()
+            self.stats["push_failures"] += 1
+            return False
+
+    def redact(self, error):
+        text = str(error)
+        parsed = urllib.parse.urlparse(self.remote_url)
+        if parsed.password:
+            text = text.replace(parsed.password, "***")
+        return text
+
+    def status(self):
+        return {
+            "backend": self.name,
+            "root": self.root,
+            "remote": self.redact(self.remote_url),
+            "branch": self.branch,
+            "unpushed_commits": self._pending,
+            "last_fetch_age": round(time.monotonic() - self.last_fetch, 1),
+            # 同步失败期间读取的是本地工作区，可能落后于远端
+            "stale": self.fetch_failures > 0,
+            "fetch_failures": self.fetch_failures,
+            "last_fetch_error": self.last_fetch_error,
+            "last_push_error": self.last_push_error,
+            "stats": dict(self.stats)
+        }
+
+    def _maybe_sync(self):
+        """距上次fetch超过fetch_interval时同步一次，并发调用只有一个真正执行；
+        同步失败时继续读取本地工作区，退避时间内不再重试"""
+        if not self._sync_due():
+            return
+        with self._locked():
+            if not self._sync_due():
+                return
+            try:
+                self.sync()
+            except StorageError as e:
+                print(f"同步远端失败，{self._fetch_backoff():.0f} 秒内读取本地工作区: {e}")
+
+    def _sync_due(self):
+        now = time.monotonic()
+        if now - self.last_fetch < self.fetch_interval:
+            return False
+        return now - self.fetch_failed_at >= self._fetch_backoff()
+
+    def _fetch_backoff(self):
+        """连续失败次数对应的重试间隔，从fetch_interval（至少1秒）开始翻倍"""
+        if not self.fetch_failures:
+            return 0.0
+        return min(max(self.fetch_interval, 1.0) * 2 ** (self.fetch_failures - 1), self.MAX_FETCH_BACKOFF)
+
+    def _commit_paths(self, paths, message):
+        self._git("add", "-A", "--", *paths)
+        if self._git("diff", "--cached", "--quiet", check=False).returncode == 0:
+            return  # 内容没有变化
+        self._git("commit", "--quiet", "-m", message)
+        self._pending += 1
+        self.stats["local_commits"] += 1
+        if self._pending >= self.push_batch:
+            try:
+                self.flush()
+            except (StorageError, DeadlineExceeded) as e:
+                # 本地提交已经成功，推送（或推送前的同步）失败不让这次写入报错，交给定时推送线程重试
+                self.last_push_error = self.redact(e)
+                print(f"推送失败，稍后重试: {self.last_push_error}")
+        if self._pending:
+            self._ensure_flusher()
+
+    def _rebase(self):
+        """本地提交冲突时以本地的批准/拒绝结果为准"""
+        result = self._git("rebase", "--quiet", "-X", "theirs", f"origin/{self.branch}", check=False)
+        if result.returncode != 0:
+            self._git("rebase", "--abort", check=False)
+            raise StorageError(f"变基到远端失败: {self.redact(result.stderr.strip())}")
+
+    def _unpushed_count(self):
+        result = self._git("rev-list", "--count", f"origin/{self.branch}..HEAD", check=False)
+        return int(result.stdout.strip() or 0) if result.returncode == 0 else 0
+
+    def _ensure_flusher(self):
+        """启动定时推送线程（gunicorn fork之后线程不会继承，所以每次使用前检查）"""
+        if self._flusher and self._flusher.is_alive():
+            return
+        with self._flusher_lock:
+            if self._flusher and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, name="git-push", daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.push_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"定时推送失败: {self.redact(e)}")
+
+    @contextmanager
+    def _locked(self):
+        with self._git_lock:
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1 and fcntl:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                yield
+            finally:
+                if self._lock_depth == 1 and fcntl:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_depth -= 1
+
+    def _git(self, *args, check=True):
+        """在工作区执行git命令，超时不超过当前请求的剩余时间预算"""
+        timeout = self.timeout
+        remaining = deadline_remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded(f"请求时间预算已用完，跳过 git {args[0]}")
+            timeout = min(timeout, remaining)
+        try:
+            result = subprocess.run(["git", *args], cwd=self.root, env=self._env,
+                                    capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise StorageError(f"git {args[0]} 超时 ({timeout:.0f} 秒)")
+        if check and result.returncode != 0:
+            raise StorageError(f"git {args[0]} 失败: {self.redact(result.stderr.strip())}")
+        return result
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""gitee_client 中请求预算、熔断器和客户端重试逻辑的单元测试，不访问网络"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from gitee_client import (GiteeClient, RateBudget, CircuitBreaker, CircuitOpenError, RateLimitExceeded,
+                          DeadlineExceeded, PRIORITY_BACKGROUND, PRIORITY_READ, PRIORITY_WRITE,
+                          SingleFlight, request_priority, request_deadline, verify_webhook)
+
+
+def make_response(status_code=200, body=b'{}'):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    return response
+
+
+class StubSession:
+    """按顺序返回预设结果的假Session，结果为异常时抛出"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url))
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+def make_client(session, budget=None, breaker=None):
+    client = GiteeClient("token", "owner/repo", api_base="http://gitee.test/api/v5", max_retries=0,
+                         budget=budget or RateBudget(per_hour=3600000, burst=1000),
+                         breaker=breaker or CircuitBreaker(failure_threshold=1, reset_timeout=0))
+    client.session = session
+    return client
+
+
+class RateBudgetTest(unittest.TestCase):
+
+    def test_write_always_allowed(self):
+        budget = RateBudget(per_hour=1, burst=1)
+        for _ in range(3):
+            budget.acquire(PRIORITY_WRITE)
+        self.assertLess(budget.tokens, 0)
+
+    def test_background_shed_below_reserve(self):
+        budget = RateBudget(per_hour=1, burst=10, background_reserve=0.5)
+        for _ in range(5):
+            budget.acquire(PRIORITY_BACKGROUND)
+        with self.assertRaises(RateLimitExceeded):
+            budget.acquire(PRIORITY_BACKGROUND)
+        self.assertEqual(budget.stats["shed"], 1)
+        # 保留的余量仍可供交互读取使用
+        budget.acquire(PRIORITY_READ)
+
+    def test_read_rejected_when_wait_too_long(self):
+        budget = RateBudget(per_hour=1, burst=1, read_max_wait=0.01)
+        budget.acquire(PRIORITY_READ)
+        with self.assertRaises(RateLimitExceeded):
+            budget.acquire(PRIORITY_READ)
+        self.assertEqual(budget.stats["rejected"], 1)
+
+    def test_observe_rate_limit_blocks_reads(self):
+        budget = RateBudget(per_hour=3600, burst=10, read_max_wait=0.01)
+        response = make_response(429)
+        response.headers['Retry-After'] = '30'
+        budget.observe(response)
+        with self.assertRaises(RateLimitExceeded):
+            budget.acquire(PRIORITY_READ)
+        budget.acquire(PRIORITY_WRITE)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        self.assertFalse(breaker.before_request())
+        breaker.record_failure("boom")
+        breaker.before_request()
+        breaker.record_failure("boom")
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_half_open_allows_single_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure("boom")
+        self.assertTrue(breaker.before_request())
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertFalse(breaker.before_request())
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        breaker.state = CircuitBreaker.OPEN
+        breaker.opened_at = time.monotonic() - 61
+        self.assertTrue(breaker.before_request())
+        breaker.record_failure("still down")
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_release_probe_keeps_state(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure("boom")
+        self.assertTrue(breaker.before_request())
+        breaker.release_probe()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.before_request())
+
+
+class GiteeClientBreakerTest(unittest.TestCase):
+
+    def test_shed_probe_does_not_lock_breaker(self):
+        budget = RateBudget(per_hour=1, burst=1, background_reserve=1.0)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure("boom")
+        client = make_client(StubSession(make_response(200)), budget=budget, breaker=breaker)
+
+        with request_priority(PRIORITY_BACKGROUND):
+            with self.assertRaises(RateLimitExceeded):
+                client.get("http://gitee.test/api/v5/repos/owner/repo/contents/requests")
+
+        # 被丢弃的探测请求归还了名额，写入仍可作为新的探测请求发出
+        response = client.post("http://gitee.test/api/v5/repos/owner/repo/commits", json={})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_deadline_bounded_probe_does_not_lock_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure("boom")
+        session = StubSession(requests.ReadTimeout("slow"), make_response(200))
+        client = make_client(session, breaker=breaker)
+
+        with request_deadline(0.5):
+            with self.assertRaises(DeadlineExceeded):
+                client.get("http://gitee.test/api/v5/repos/owner/repo/contents/requests")
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+        response = client.get("http://gitee.test/api/v5/repos/owner/repo/contents/requests")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class VerifyWebhookTest(unittest.TestCase):
+
+    def test_password(self):
+        self.assertTrue(verify_webhook("secret", "secret")[0])
+        self.assertFalse(verify_webhook("secret", "wrong")[0])
+
+    def test_non_ascii_token_rejected(self):
+        self.assertFalse(verify_webhook("secret", "密码")[0])
+        self.assertTrue(verify_webhook("密码", "密码")[0])
+        self.assertFalse(verify_webhook("secret", "签名", timestamp=str(int(time.time() * 1000)))[0])
+        # 请求体中的password可能不是字符串
+        self.assertFalse(verify_webhook("secret", 12345)[0])
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def start_leader(self, flights, fn):
+        """在后台线程中以领头身份调用fn，返回 (线程, 领头调用已开始的事件)"""
+        started = threading.Event()
+
+        def run():
+            try:
+                flights.do("key", lambda: (started.set(), fn())[1])
+            except Exception:
+                pass
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        started.wait(1)
+        return thread
+
+    def test_followers_share_result(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        thread = self.start_leader(flights, lambda: release.wait(1) and "shared")
+        threading.Timer(0.05, release.set).start()
+        self.assertEqual(flights.do("key", lambda: "own"), "shared")
+        thread.join()
+        self.assertEqual(flights.stats["shared"], 1)
+
+    def test_follower_wait_bounded_by_deadline(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        thread = self.start_leader(flights, lambda: release.wait(2))
+        started = time.monotonic()
+        with request_deadline(0.1):
+            with self.assertRaises(DeadlineExceeded):
+                flights.do("key", lambda: "own")
+        self.assertLess(time.monotonic() - started, 1)
+        release.set()
+        thread.join()
+
+    def test_leader_context_error_not_shared(self):
+        flights = SingleFlight()
+        release = threading.Event()
+
+        def shed():
+            release.wait(1)
+            raise RateLimitExceeded("background shed")
+
+        thread = self.start_leader(flights, shed)
+        threading.Timer(0.05, release.set).start()
+        self.assertEqual(flights.do("key", lambda: "own"), "own")
+        thread.join()
+        self.assertEqual(flights.stats["retried"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""job_queue 的单元测试，使用临时目录中的SQLite数据库"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from job_queue import JobQueue, QUEUED, DONE, FAILED
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.workdir, 'jobs.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_enqueue_returns_existing_job(self):
+        jobs = JobQueue(self.db_path, None)
+        job_id, created, kind = jobs.enqueue("approved", "M1", {"machine_code": "M1"})
+        self.assertEqual((created, kind), (True, "approved"))
+        self.assertEqual(jobs.enqueue("rejected", "M1", {"machine_code": "M1"}), (job_id, False, "approved"))
+        self.assertEqual(jobs.get(job_id)['status'], QUEUED)
+
+    def test_concurrent_enqueue_creates_one_job(self):
+        # 每个线程用自己的JobQueue，相当于多个gunicorn worker共享同一个数据库文件
+        queues = [JobQueue(self.db_path, None) for _ in range(8)]
+        barrier = threading.Barrier(len(queues))
+        created = []
+
+        def enqueue(jobs):
+            barrier.wait()
+            created.append(jobs.enqueue("approved", "M1", {"machine_code": "M1"})[1])
+
+        threads = [threading.Thread(target=enqueue, args=(jobs,)) for jobs in queues]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(created.count(True), 1)
+        self.assertEqual(queues[0].counts(), {QUEUED: 1})
+
+    def test_on_failed_called_after_last_attempt(self):
+        failed = []
+        jobs = JobQueue(self.db_path, lambda kind, payload: (False, "boom"), max_attempts=2, retry_delay=0,
+                        on_failed=lambda kind, payload: failed.append((kind, payload)))
+        job_id, _, _ = jobs.enqueue("approved", "M1", {"machine_code": "M1"})
+        jobs._process(jobs._claim())
+        self.assertEqual(failed, [])
+        self.assertEqual(jobs.get(job_id)['status'], QUEUED)
+        jobs._process(jobs._claim())
+        self.assertEqual(failed, [("approved", {"machine_code": "M1"})])
+        self.assertEqual(jobs.get(job_id)['status'], FAILED)
+
+    def test_purge_removes_old_done_jobs(self):
+        jobs = JobQueue(self.db_path, lambda kind, payload: (True, "ok"), retention=60)
+        done_id, _, _ = jobs.enqueue("approved", "M1", {"machine_code": "M1"})
+        with redirect_stdout(StringIO()):
+            jobs._process(jobs._claim())
+        queued_id, _, _ = jobs.enqueue("approved", "M2", {"machine_code": "M2"})
+
+        self.assertEqual(jobs.get(done_id)['status'], DONE)
+        self.assertEqual(jobs.purge(), 0)
+        self.assertEqual(jobs.purge(now=time.time() + 120), 1)
+        self.assertIsNone(jobs.get(done_id))
+        self.assertEqual(jobs.get(queued_id)['status'], QUEUED)
+        self.assertEqual(jobs.counts(), {QUEUED: 1})
+
+    def test_connections_are_closed(self):
+        jobs = JobQueue(self.db_path, None)
+        with jobs._connect() as conn:
+            pass
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+if __name__ == '__main__':
+    unittest.main()
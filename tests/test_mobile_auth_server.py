@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""mobile_auth_server_clean 的集成测试
+服务模块导入时会创建全局管理器，所以整个文件只导入一次，指向进程内的码云替身（benchmarks/fake_gitee.py）；
+各个测试另外创建使用LocalBackend的管理器"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from io import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fake_gitee import FakeGitee
+from benchmarks.run_benchmarks import load_app, quiet, measure, summarize, CALL_BUDGETS
+from gitee_client import GiteeClient, RateBudget
+from job_queue import JobQueue
+from request_index import INDEX_PATH
+from storage import LocalBackend, GiteeBackend, StorageError
+
+fake = None
+app = None
+workdir = None
+
+
+def setUpModule():
+    global fake, app, workdir
+    fake = FakeGitee(latency=0, jitter=0)
+    workdir = tempfile.mkdtemp()
+    app = load_app(fake.start(), workdir)
+
+
+def tearDownModule():
+    fake.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def request_text(machine_code, request_time=None, status="pending"):
+    return json.dumps({
+        "machine_code": machine_code,
+        "status": status,
+        "request_time": (request_time or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+    }, ensure_ascii=False, indent=2)
+
+
+class LocalManagerTestCase(unittest.TestCase):
+    """在临时目录中的LocalBackend上创建管理器，被测代码的输出不显示"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage = LocalBackend(self.root)
+        self._quiet = redirect_stdout(StringIO())
+        self._quiet.__enter__()
+
+    def tearDown(self):
+        self._quiet.__exit__(None, None, None)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def manager(self):
+        manager = app.MobileAuthManager(storage=self.storage)
+        manager.fetch_pending_requests()
+        return manager
+
+    def read_json(self, path):
+        result = self.storage.read_file(path)
+        return json.loads(result[0]) if result else None
+
+
+class RequestStatusTest(LocalManagerTestCase):
+
+    def test_status_and_index_in_one_commit(self):
+        self.storage.write_file("requests/M1.json", request_text("M1"), "m1")
+        manager = self.manager()
+        commits, writes = self.storage.stats["commits"], self.storage.stats["writes"]
+
+        self.assertTrue(manager._update_request_status("M1", "approved"))
+        self.assertEqual(self.storage.stats["commits"], commits + 1)
+        self.assertEqual(self.storage.stats["writes"], writes)
+        self.assertEqual(self.read_json("requests/M1.json")['status'], "approved")
+        entry = self.read_json(INDEX_PATH)['entries']["requests/M1.json"]
+        self.assertEqual(entry['status'], "approved")
+        self.assertEqual(entry['sha'], self.storage.known_sha("requests/M1.json"))
+
+    def test_resubmitted_request_is_not_overwritten(self):
+        self.storage.write_file("requests/M1.json", request_text("M1", datetime(2026, 1, 1, 10)), "m1")
+        manager = self.manager()
+        commit = self.storage.commit
+
+        def resubmit_then_commit(actions, message):
+            # 读取之后、提交之前桌面版重新提交了请求
+            self.storage.commit = commit
+            self.storage.write_file("requests/M1.json", request_text("M1", datetime(2026, 1, 2, 10)), "resubmit")
+            return commit(actions, message)
+
+        self.storage.commit = resubmit_then_commit
+        self.assertTrue(manager._update_request_status("M1", "rejected"))
+        data = self.read_json("requests/M1.json")
+        self.assertEqual(data['status'], "rejected")
+        self.assertEqual(data['request_time'], "2026-01-02 10:00:00")
+
+    def test_queued_opposite_decision_wins(self):
+        self.storage.write_file("requests/M1.json", request_text("M1"), "m1")
+        jobs = JobQueue(os.path.join(self.root, "jobs.sqlite3"), None)
+        first, second = self.manager(), self.manager()
+
+        success, _, job_id = first.enqueue_rejection(jobs, "M1")
+        self.assertTrue(success)
+        # 另一个worker还不知道本次拒绝，又提交了批准
+        success, message, existing = second.enqueue_approval(jobs, "M1")
+        self.assertFalse(success)
+        self.assertEqual(existing, job_id)
+        self.assertIn("rejected", message)
+        self.assertEqual(second.overlay.decision("M1"), "rejected")
+
+
+class BatchCommitTest(LocalManagerTestCase):
+    """批量批准/拒绝：响应、请求状态、索引和处理记录在一次提交中完成"""
+
+    def test_batch_is_one_commit(self):
+        for machine_code in ("M1", "M2"):
+            self.storage.write_file(f"requests/{machine_code}.json", request_text(machine_code), machine_code)
+        manager = self.manager()
+        commits = self.storage.stats["commits"]
+
+        results = manager.approve_batch([{"machine_code": machine_code, "expire_hours": 24}
+                                         for machine_code in ("M1", "M2", "M3")])
+        self.assertEqual([result['success'] for result in results], [True, True, True])
+        self.assertIn("warning", results[2])
+        self.assertEqual(self.storage.stats["commits"], commits + 1)
+
+        index = self.read_json(INDEX_PATH)['entries']
+        for machine_code in ("M1", "M2"):
+            path = f"requests/{machine_code}.json"
+            self.assertEqual(self.read_json(path)['status'], "approved")
+            self.assertEqual(index[path]['sha'], self.storage.known_sha(path))
+        for machine_code in ("M1", "M2", "M3"):
+            self.assertEqual(self.read_json(f"responses/{machine_code}.json")['status'], "approved")
+            self.assertEqual(manager.overlay.decision(machine_code), "approved")
+        self.assertEqual(self.manager().processed_requests,
+                         {f"requests/{machine_code}.json" for machine_code in ("M1", "M2", "M3")})
+
+    def test_batch_rebuilt_after_resubmit(self):
+        for machine_code in ("M1", "M2"):
+            self.storage.write_file(f"requests/{machine_code}.json",
+                                    request_text(machine_code, datetime(2026, 1, 1, 10)), machine_code)
+        manager = self.manager()
+        commit = self.storage.commit
+
+        def resubmit_then_commit(actions, message):
+            self.storage.commit = commit
+            self.storage.write_file("requests/M2.json", request_text("M2", datetime(2026, 1, 2, 10)), "resubmit")
+            return commit(actions, message)
+
+        self.storage.commit = resubmit_then_commit
+        results = manager.reject_batch([{"machine_code": machine_code, "reason": "test"}
+                                        for machine_code in ("M1", "M2")])
+        self.assertTrue(all(result['success'] for result in results))
+        data = self.read_json("requests/M2.json")
+        self.assertEqual(data['status'], "rejected")
+        self.assertEqual(data['request_time'], "2026-01-02 10:00:00")
+        self.assertEqual(self.read_json("requests/M1.json")['status'], "rejected")
+
+    def test_failed_commit_fails_every_item(self):
+        self.storage.write_file("requests/M1.json", request_text("M1"), "m1")
+        manager = self.manager()
+
+        def fail(actions, message):
+            raise StorageError("boom")
+
+        self.storage.commit = fail
+        results = manager.reject_batch([{"machine_code": "M1", "reason": "test"},
+                                        {"machine_code": "M2", "reason": "test"}])
+        self.assertEqual([result['success'] for result in results], [False, False])
+        self.assertIsNone(manager.overlay.decision("M1"))
+        self.assertIsNone(self.read_json("responses/M1.json"))
+
+
+class DecisionOverlayTest(LocalManagerTestCase):
+    """本进程的决定在TTL内覆盖上游仍返回的pending内容，上游追上、请求重新提交或过期后移除"""
+
+    def setUp(self):
+        super().setUp()
+        self.requested_at = datetime.now() - timedelta(minutes=10)
+        self.storage.write_file("requests/M1.json", request_text("M1", self.requested_at), "m1")
+
+    def decide(self, manager, seconds_ago=0):
+        self.assertTrue(manager.approve_request("M1")[0])
+        status, written_at, job_id = manager.overlay._entries["M1"]
+        manager.overlay._entries["M1"] = (status, written_at - seconds_ago, job_id)
+        # 上游还返回决定之前的内容
+        self.storage.write_file("requests/M1.json", request_text("M1", self.requested_at), "lagging")
+
+    def pending_codes(self, manager):
+        return [item['machine_code'] for item in manager.fetch_pending_requests()[0]]
+
+    def test_lagging_request_hidden_until_ttl_expires(self):
+        manager = self.manager()
+        self.decide(manager)
+        self.assertEqual(self.pending_codes(manager), [])
+        self.assertEqual(manager.overlay.decision("M1"), "approved")
+
+        manager.overlay.ttl = 0
+        self.assertEqual(self.pending_codes(manager), ["M1"])
+        self.assertIsNone(manager.overlay.decision("M1"))
+        self.assertEqual(len(manager.overlay), 0)
+
+    def test_entry_dropped_once_upstream_caught_up(self):
+        manager = self.manager()
+        self.assertTrue(manager.approve_request("M1")[0])
+        self.assertEqual(self.pending_codes(manager), [])
+        self.assertEqual(len(manager.overlay), 0)
+
+    def test_partial_scan_keeps_entry(self):
+        manager = self.manager()
+        self.assertTrue(manager.approve_request("M1")[0])
+        self.assertEqual(manager.overlay.apply([], complete=False), [])
+        self.assertEqual(len(manager.overlay), 1)
+
+    def test_resubmitted_request_shows_again(self):
+        manager = self.manager()
+        self.decide(manager, seconds_ago=120)
+        self.storage.write_file("requests/M1.json", request_text("M1", datetime.now() - timedelta(minutes=1)),
+                                "resubmit")
+        self.assertEqual(self.pending_codes(manager), ["M1"])
+        self.assertEqual(len(manager.overlay), 0)
+
+
+class WebhookTest(LocalManagerTestCase):
+    """/api/webhook/gitee：校验令牌后只读取推送中改动的请求文件，增量更新快照"""
+
+    def setUp(self):
+        super().setUp()
+        self.storage.write_file("requests/M1.json", request_text("M1"), "m1")
+        self.stamp = app.WebhookStamp(os.path.join(self.root, "webhook.stamp"))
+        self.refresher = app.RequestRefresher(self.manager(), 0, app.ChangeBroadcaster(), stamp=self.stamp)
+        self.refresher.refresh()
+        for name, value in (("GITEE_WEBHOOK_SECRET", "secret"), ("request_refresher", self.refresher),
+                            ("auth_manager", self.refresher.manager)):
+            self.addCleanup(setattr, app, name, getattr(app, name))
+            setattr(app, name, value)
+        self.client = app.app.test_client()
+
+    def push(self, commits, token="secret", ref="refs/heads/master", event="Push Hook"):
+        return self.client.post("/api/webhook/gitee", json={"ref": ref, "commits": commits},
+                                headers={"X-Gitee-Token": token, "X-Gitee-Event": event})
+
+    def pending_codes(self):
+        return {item['machine_code'] for item in self.refresher.snapshot.requests}
+
+    def test_disabled_without_secret(self):
+        app.GITEE_WEBHOOK_SECRET = ""
+        self.assertEqual(self.push([]).status_code, 404)
+
+    def test_wrong_token_is_rejected(self):
+        self.storage.write_file("requests/M2.json", request_text("M2"), "m2")
+        self.assertEqual(self.push([{"added": ["requests/M2.json"]}], token="wrong").status_code, 401)
+        self.assertEqual(self.pending_codes(), {"M1"})
+        self.assertEqual(self.stamp.last_received(), 0.0)
+
+    def test_push_updates_only_changed_files(self):
+        self.storage.write_file("requests/M2.json", request_text("M2"), "m2")
+        self.storage.commit([{"action": "delete", "path": "requests/M1.json"}], "m1")
+        reads = self.storage.stats["reads"]
+
+        response = self.push([{"added": ["requests/M2.json", "responses/M2.json"]},
+                              {"removed": ["requests/M1.json"]}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"success": True, "updated": 1, "removed": 1, "skipped": 0})
+        self.assertEqual(self.storage.stats["reads"], reads + 1)
+        self.assertEqual(self.pending_codes(), {"M2"})
+        self.assertGreater(self.stamp.last_received(), 0.0)
+
+    def test_other_branches_and_events_are_ignored(self):
+        self.storage.write_file("requests/M2.json", request_text("M2"), "m2")
+        for response in (self.push([{"added": ["requests/M2.json"]}], ref="refs/heads/dev"),
+                         self.push([], event="Tag Push Hook")):
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("忽略", response.get_json()['message'])
+        self.assertEqual(self.pending_codes(), {"M1"})
+
+
+class UpstreamCallsTest(unittest.TestCase):
+    """码云替身上的每次操作上游调用数，与压测的CALL_BUDGETS一致"""
+
+    def setUp(self):
+        fake.reset()
+        self.machine_codes = fake.seed_requests(20, pending_ratio=0.5)
+        with quiet():
+            self.manager = app.MobileAuthManager()
+            self.manager.fetch_pending_requests()
+            # 等待扫描触发的后台索引重建完成，不计入写入的调用数
+            with self.manager._index_rebuilding:
+                pass
+
+    def calls_per_op(self, scenario, operation, iterations):
+        with quiet():
+            durations, errors, elapsed, calls = measure(fake.take_calls, operation, iterations)
+        self.assertEqual(errors, 0)
+        return summarize(scenario, {}, durations, errors, elapsed, calls)['upstream_calls_per_op']
+
+    def test_approve_within_budget(self):
+        per_op = self.calls_per_op("approve_request",
+                                   lambda i: self.manager.approve_request(self.machine_codes[i])[0], 5)
+        self.assertLessEqual(per_op, CALL_BUDGETS["approve_request"])
+
+    def test_reject_within_budget(self):
+        per_op = self.calls_per_op("reject_request",
+                                   lambda i: self.manager.reject_request(self.machine_codes[i], "test")[0], 5)
+        self.assertLessEqual(per_op, CALL_BUDGETS["reject_request"])
+
+
+class BudgetLimitedScanTest(unittest.TestCase):
+    """请求预算不足时没有下载的文件计为跳过：列表标记为不完整，不清除缓存，也不推送移除"""
+
+    def setUp(self):
+        fake.reset()
+        fake.seed_requests(30)
+        self._quiet = redirect_stdout(StringIO())
+        self._quiet.__enter__()
+
+    def tearDown(self):
+        self._quiet.__exit__(None, None, None)
+
+    def manager(self, burst):
+        client = GiteeClient(app.GITEE_TOKEN, app.GITEE_REPO, api_base=app.GITEE_API_BASE,
+                             budget=RateBudget(per_hour=1, burst=burst, read_max_wait=0))
+        return app.MobileAuthManager(storage=GiteeBackend(client))
+
+    def test_rate_limited_files_are_skipped(self):
+        requests_list, skipped = self.manager(burst=15).fetch_pending_requests()
+        self.assertGreater(skipped, 0)
+        self.assertEqual(len(requests_list) + skipped, 30)
+
+    def test_skipped_files_keep_cached_entries(self):
+        manager = self.manager(burst=1000)
+        requests_list, skipped = manager.fetch_pending_requests()
+        self.assertEqual((len(requests_list), skipped), (30, 0))
+        # 所有请求文件都有新版本，但预算只够列目录
+        fake.seed_requests(30, now=datetime.now() - timedelta(minutes=5))
+        manager.storage.client.budget = RateBudget(per_hour=1, burst=5, read_max_wait=0)
+        requests_list, skipped = manager.fetch_pending_requests()
+        self.assertGreater(skipped, 0)
+        self.assertEqual(len(requests_list), 30)
+
+    def test_partial_refresh_is_flagged_and_pushes_no_removals(self):
+        broadcaster = app.ChangeBroadcaster()
+        subscriber = broadcaster.subscribe()
+        refresher = app.RequestRefresher(self.manager(burst=1000), 0, broadcaster)
+        self.assertEqual(len(refresher.refresh().requests), 30)
+        self.assertEqual(subscriber.get_nowait()[0], "snapshot")
+
+        # 冷启动的worker预算不足，只下载了一部分文件
+        refresher.manager = self.manager(burst=15)
+        snapshot = refresher.refresh()
+        self.assertGreater(snapshot.skipped, 0)
+        self.assertLess(len(snapshot.requests), 30)
+        self.assertTrue(refresher.snapshot_info(snapshot)["partial"])
+        self.assertTrue(app.snapshot_payload(snapshot)["partial"])
+        while not subscriber.empty():
+            event, payload = subscriber.get_nowait()
+            self.assertEqual(payload["removed"], [])
+
+
+class ChangeBroadcasterTest(unittest.TestCase):
+
+    def test_concurrent_publishers_on_full_queue(self):
+        broadcaster = app.ChangeBroadcaster(max_queue=1)
+        subscriber = broadcaster.subscribe()
+        # 缩短线程切换间隔，让发布者在清空队列和放入resync之间交错
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+        barrier = threading.Barrier(8)
+        errors = []
+
+        def publish(i):
+            barrier.wait()
+            try:
+                for _ in range(200):
+                    broadcaster.publish("changes", {"seq": i})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=publish, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(subscriber.get_nowait(), ("resync", None))
+
+
+if __name__ == '__main__':
+    unittest.main()
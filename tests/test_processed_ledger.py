@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""processed_ledger 的单元测试，使用临时目录中的LocalBackend"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from processed_ledger import ProcessedLedger, HEAD_PATH, LEGACY_PATH, LEDGER_DIR, LEGACY_SEGMENT
+from storage import LocalBackend, StorageConflict
+
+
+class ProcessedLedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.storage = LocalBackend(self.workdir)
+        # 账本每次加载和提交都会打印进度
+        self._quiet = redirect_stdout(StringIO())
+        self._quiet.__enter__()
+
+    def tearDown(self):
+        self._quiet.__exit__(None, None, None)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def fresh_entries(self, **kwargs):
+        ledger = ProcessedLedger(self.storage, **kwargs)
+        ledger.load()
+        return ledger.entries()
+
+    def test_append_then_load(self):
+        ledger = ProcessedLedger(self.storage)
+        ledger.load()
+        self.assertTrue(ledger.append(["requests/M1.json"], "m1"))
+        self.assertTrue(ledger.append(["requests/M2.json", "requests/M1.json"], "m2"))
+        self.assertEqual(self.fresh_entries(), {"requests/M1.json", "requests/M2.json"})
+        self.assertIsNotNone(self.storage.read_file(HEAD_PATH))
+
+    def test_migrates_legacy_file_once(self):
+        self.storage.write_file(LEGACY_PATH, json.dumps(["requests/OLD.json"]), "legacy")
+        ledger = ProcessedLedger(self.storage)
+        ledger.load()
+        self.assertEqual(ledger.entries(), {"requests/OLD.json"})
+        segment, _ = self.storage.read_file(f"{LEDGER_DIR}/{LEGACY_SEGMENT}")
+        self.assertEqual(json.loads(segment), ["requests/OLD.json"])
+        # 迁移之后旧文件的新记录只有开启同步时才会合并
+        self.storage.write_file(LEGACY_PATH, json.dumps(["requests/OLD.json", "requests/NEW.json"]), "desktop")
+        self.assertEqual(self.fresh_entries(), {"requests/OLD.json"})
+        self.assertEqual(self.fresh_entries(legacy_sync=True), {"requests/OLD.json", "requests/NEW.json"})
+
+    def test_legacy_sync_writes_back(self):
+        self.storage.write_file(LEGACY_PATH, json.dumps(["requests/OLD.json"]), "legacy")
+        ledger = ProcessedLedger(self.storage, legacy_sync=True)
+        ledger.load()
+        ledger.append(["requests/M1.json"], "m1")
+        legacy, _ = self.storage.read_file(LEGACY_PATH)
+        self.assertEqual(json.loads(legacy), ["requests/OLD.json", "requests/M1.json"])
+
+    def test_concurrent_appends_keep_every_entry(self):
+        # 两个账本实例共享同一个存储，相当于两个gunicorn worker
+        ledgers = [ProcessedLedger(self.storage) for _ in range(2)]
+        for ledger in ledgers:
+            ledger.load()
+        paths = [f"requests/M{i}.json" for i in range(8)]
+        barrier = threading.Barrier(len(paths))
+        failures = []
+
+        def append(i):
+            barrier.wait()
+            if not ledgers[i % 2].append([paths[i]], f"append {i}"):
+                failures.append(i)
+
+        threads = [threading.Thread(target=append, args=(i,)) for i in range(len(paths))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+        self.assertEqual(self.fresh_entries(), set(paths))
+
+    def test_commit_append_rebuilds_actions_after_conflict(self):
+        ledger = ProcessedLedger(self.storage)
+        ledger.load()
+        ledger.append(["requests/M1.json"], "m1")
+        # 另一个worker在本实例不知道的情况下追加了记录
+        other = ProcessedLedger(self.storage)
+        other.load()
+        other.append(["requests/M2.json"], "m2")
+
+        calls = []
+
+        def build_actions():
+            calls.append(1)
+            return [{"action": "create", "path": "responses/M3.json", "content": "{}"}], len(calls)
+
+        self.assertEqual(ledger.commit_append(["requests/M3.json"], "m3", build_actions), 2)
+        self.assertEqual(self.fresh_entries(), {"requests/M1.json", "requests/M2.json", "requests/M3.json"})
+        self.assertIsNotNone(self.storage.read_file("responses/M3.json"))
+
+    def test_commit_precondition_writes_nothing_on_conflict(self):
+        self.storage.write_file("a.json", "1", "a")
+        with self.assertRaises(StorageConflict):
+            self.storage.commit([{"action": "create", "path": "b.json", "content": "2"},
+                                 {"action": "update", "path": "a.json", "content": "3", "sha": "0" * 40}], "ab")
+        self.assertIsNone(self.storage.read_file("b.json"))
+        self.assertEqual(self.storage.read_file("a.json")[0], "1")
+
+
+if __name__ == '__main__':
+    unittest.main()
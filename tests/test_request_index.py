@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""request_index 的单元测试，使用临时目录中的LocalBackend"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from request_index import RequestIndex, INDEX_PATH, index_entry
+from storage import LocalBackend
+
+
+def request_text(machine_code, status="pending"):
+    return json.dumps({"machine_code": machine_code, "status": status,
+                       "request_time": "2026-01-01 10:00:00"}, indent=2)
+
+
+class RequestIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.storage = LocalBackend(self.workdir)
+        self._quiet = redirect_stdout(StringIO())
+        self._quiet.__enter__()
+
+    def tearDown(self):
+        self._quiet.__exit__(None, None, None)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def commit(self, index, changes):
+        actions, state = index.build_update(changes)
+        self.storage.commit(actions, "index")
+        index.apply(state)
+
+    def test_missing_index_loads_empty(self):
+        index = RequestIndex(self.storage)
+        self.assertFalse(index.load())
+        self.assertEqual(index.entries, {})
+        self.assertFalse(index.exists)
+
+    def test_update_and_reload(self):
+        self.storage.write_file("requests/M1.json", request_text("M1"), "m1")
+        sha = self.storage.known_sha("requests/M1.json")
+        index = RequestIndex(self.storage)
+        index.load()
+        self.commit(index, {"requests/M1.json": index_entry(json.loads(request_text("M1")), sha)})
+
+        reloaded = RequestIndex(self.storage)
+        self.assertTrue(reloaded.load())
+        self.assertEqual(reloaded.match("requests/M1.json", sha)['status'], "pending")
+        self.assertIsNone(reloaded.match("requests/M1.json", "0" * 40))
+        # 目录列表中的sha与已加载的一致时不再读取
+        reads = self.storage.stats["reads"]
+        reloaded.load(self.storage.known_sha(INDEX_PATH))
+        self.assertEqual(self.storage.stats["reads"], reads)
+
+    def test_drift_counts_new_changed_and_deleted_files(self):
+        for machine_code in ("M1", "M2"):
+            self.storage.write_file(f"requests/{machine_code}.json", request_text(machine_code), machine_code)
+        index = RequestIndex(self.storage)
+        index.load()
+        self.commit(index, {f"requests/{machine_code}.json": index_entry(
+            {"status": "pending"}, self.storage.known_sha(f"requests/{machine_code}.json")) for machine_code in ("M1", "M2")})
+        listing = [entry for entry in self.storage.list_dir("requests") if entry['name'] != "_index"]
+        self.assertEqual(index.drift(listing), 0)
+
+        self.storage.write_file("requests/M1.json", request_text("M1", "approved"), "m1")
+        self.storage.write_file("requests/M3.json", request_text("M3"), "m3")
+        self.storage.commit([{"action": "delete", "path": "requests/M2.json"}], "m2")
+        listing = [entry for entry in self.storage.list_dir("requests") if entry['name'] != "_index"]
+        self.assertEqual(index.drift(listing), 3)
+
+    def test_delete_entry(self):
+        index = RequestIndex(self.storage)
+        index.load()
+        self.commit(index, {"requests/M1.json": index_entry({"status": "approved"}, "a" * 40)})
+        self.commit(index, {"requests/M1.json": None})
+        reloaded = RequestIndex(self.storage)
+        reloaded.load()
+        self.assertEqual(reloaded.entries, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
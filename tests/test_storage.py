@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""GitMirrorBackend 的单元测试，远端是临时目录中的裸仓库，移走裸仓库模拟远端不可用"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from storage import GitMirrorBackend
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@localhost",
+               GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@localhost")
+
+
+def git(cwd, *args):
+    return subprocess.run(["git", *args], cwd=cwd, env=GIT_ENV, check=True,
+                          capture_output=True, text=True).stdout
+
+
+@unittest.skipUnless(shutil.which("git"), "需要git")
+class GitMirrorBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.remote = os.path.join(self.workdir, "remote.git")
+        git(self.workdir, "init", "--quiet", "--bare", self.remote)
+        git(self.remote, "symbolic-ref", "HEAD", "refs/heads/master")
+        seed = os.path.join(self.workdir, "seed")
+        git(self.workdir, "clone", "--quiet", self.remote, seed)
+        os.makedirs(os.path.join(seed, "requests"))
+        with open(os.path.join(seed, "requests", "M1.json"), "w") as f:
+            f.write('{"status": "pending"}')
+        git(seed, "add", "-A")
+        git(seed, "commit", "--quiet", "-m", "seed")
+        git(seed, "push", "--quiet", "origin", "HEAD:master")
+
+        self._quiet = redirect_stdout(StringIO())
+        self._quiet.__enter__()
+        self.mirror = GitMirrorBackend(self.remote, os.path.join(self.workdir, "mirror"),
+                                       push_batch=1, push_interval=3600, fetch_interval=0)
+
+    def tearDown(self):
+        self._quiet.__exit__(None, None, None)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def take_remote_offline(self):
+        os.rename(self.remote, self.remote + ".offline")
+
+    def bring_remote_back(self):
+        os.rename(self.remote + ".offline", self.remote)
+
+    def test_failed_fetch_serves_working_tree_with_backoff(self):
+        self.take_remote_offline()
+        self.assertEqual(self.mirror.read_file("requests/M1.json")[0], '{"status": "pending"}')
+        status = self.mirror.status()
+        self.assertTrue(status["stale"])
+        self.assertEqual(status["fetch_failures"], 1)
+        # 退避期间的读取不再fetch
+        self.mirror.list_dir("requests")
+        self.assertEqual(self.mirror.fetch_failures, 1)
+
+        self.bring_remote_back()
+        self.mirror.fetch_failed_at -= GitMirrorBackend.MAX_FETCH_BACKOFF
+        self.mirror.read_file("requests/M1.json")
+        self.assertFalse(self.mirror.status()["stale"])
+
+    def test_push_failure_is_deferred(self):
+        self.take_remote_offline()
+        self.assertTrue(self.mirror.write_file("responses/M1.json", "{}", "响应"))
+        status = self.mirror.status()
+        self.assertEqual(status["unpushed_commits"], 1)
+        self.assertTrue(status["last_push_error"])
+
+        self.bring_remote_back()
+        self.assertTrue(self.mirror.flush())
+        self.assertEqual(git(self.remote, "show", "master:responses/M1.json"), "{}")
+        self.assertIsNone(self.mirror.status()["last_push_error"])
+
+
+if __name__ == '__main__':
+    unittest.main()